@@ -0,0 +1,153 @@
+import argparse
+import glob
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from typing import *
+from cache import get_shared_cache
+from main import count_available_cores, engine_help, engines, format_solution, shared_cache_help, solve_puzzle, timeout_help
+from puzzle import Puzzle, PuzzleError, iter_puzzles_from_file
+
+
+#====================================================================================
+
+
+def load_puzzles(inputs: List[str]) -> List[Tuple[str, Union[Puzzle, PuzzleError]]]:
+    """
+    Collect named puzzles from files, directories and glob patterns; files may hold several puzzles, in the text
+    format or as JSON lines, whose ids are used in the names. The names are made safe to use as file names and
+    unique, so that no two puzzles write the same solution file. A puzzle that cannot be parsed is kept under its
+    name as a PuzzleError, for solve_task to report, and only a file that cannot be read at all is skipped.
+    """
+    filenames = []
+    for path in inputs:
+        if os.path.isdir(path):
+            filenames.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if os.path.isfile(os.path.join(path, name))))
+        elif any(character in path for character in '*?['):
+            filenames.extend(sorted(glob.glob(path)))
+        else:
+            filenames.append(path)
+
+    named_puzzles, names = [], set()
+    for filename in filenames:
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        try:
+            records = list(iter_puzzles_from_file(filename))
+        except (OSError, UnicodeDecodeError) as error:
+            print("Warning: skipping {}, it could not be read ({}: {})".format(filename, type(error).__name__, error), file=sys.stderr)
+            continue
+        for k, (record_id, puzzle) in enumerate(records):
+            if len(records) == 1 and record_id is None:
+                name = stem
+            else:
+                name = stem + '_' + (str(k + 1) if record_id is None else re.sub(r'[^\w.-]', '_', str(record_id)))
+            if name in names:
+                unique_name = next(name + '_' + str(n) for n in itertools.count(2) if name + '_' + str(n) not in names)
+                print("Warning: {} is used by several puzzles, naming the one in {} {}".format(name, filename, unique_name), file=sys.stderr)
+                name = unique_name
+            names.add(name)
+            named_puzzles.append((name, puzzle))
+    return named_puzzles
+
+
+def solve_batch(named_puzzles: List[Tuple[str, Union[Puzzle, PuzzleError]]], engine: str = 'cells', processes: Optional[int] = None, timeout: Optional[float] = None, cache_path: Optional[str] = None) -> Iterator[Dict[str, any]]:
+    """
+    Solve the puzzles on a process pool, yielding one result per puzzle in completion order. With a cache path, the
+    workers share a solution cache in that SQLite file.
+    """
+    if processes is None:
+        processes = count_available_cores()
+    tasks = [(name, puzzle, engine, timeout, cache_path) for name, puzzle in named_puzzles]
+    with multiprocessing.Pool(processes) as pool:
+        yield from pool.imap_unordered(solve_task, tasks, chunksize=1)
+
+
+def solve_task(task: Tuple[str, Union[Puzzle, PuzzleError], str, Optional[float], Optional[str]]) -> Dict[str, any]:
+    """Solve one puzzle, turning failures, and puzzles that could not be read, into a result instead of an exception"""
+    name, puzzle, engine, timeout, cache_path = task
+    result = {'name': name, 'status': 'error', 'seconds': 0.0, 'nodes': 0, 'solution': None}
+    if isinstance(puzzle, PuzzleError):
+        result['error'] = '{}: {}'.format(type(puzzle).__name__, puzzle)
+        return result
+    start = time.perf_counter()
+    try:
+        solve_result = solve_puzzle(puzzle, engine, time_limit=timeout, cache=None if cache_path is None else get_shared_cache(cache_path))
+        result['status'] = solve_result.status
+        result['nodes'] = solve_result.nodes
+        if len(solve_result.solutions) > 0:
+            result['solution'] = format_solution(solve_result.solutions[0], puzzle.get_size())
+    except Exception as error:
+        result['error'] = '{}: {}'.format(type(error).__name__, error)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+#====================================================================================
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Solve many puzzles in one run on a pool of worker processes.")
+    parser.add_argument(
+        "inputs",
+        nargs='+',
+        help="Puzzle files (one or more puzzles separated by blank lines), directories or glob patterns."
+    )
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument(
+        "--outputdir",
+        type=str,
+        help="Directory to write one solution file per puzzle into."
+    )
+    output.add_argument(
+        "--outputfile",
+        type=str,
+        help="File to write all results into, one JSON object per line."
+    )
+    parser.add_argument(
+        "--engine",
+        choices=engines,
+        default='cells',
+        help=engine_help
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: one per available core)."
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help=timeout_help
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default=None,
+        help=shared_cache_help
+    )
+    args = parser.parse_args()
+
+    named_puzzles = load_puzzles(args.inputs)
+    if args.outputdir is not None:
+        os.makedirs(args.outputdir, exist_ok=True)
+    results_file = open(args.outputfile, "w") if args.outputfile is not None else None
+    num_solved, start = 0, time.perf_counter()
+    for result in solve_batch(named_puzzles, args.engine, args.processes, args.timeout, args.cache):
+        if result['status'] == 'solved':
+            num_solved += 1
+        if results_file is not None:
+            results_file.write(json.dumps(result) + '\n')
+        elif result['solution'] is not None:
+            output_file = open(os.path.join(args.outputdir, result['name'] + '.txt'), "w")
+            output_file.write(''.join(line + '\n' for line in result['solution']))
+            output_file.close()
+        print("{}: {} in {:.3f}s{}".format(result['name'], result['status'], result['seconds'], ' (' + result['error'] + ')' if 'error' in result else ''))
+    if results_file is not None:
+        results_file.close()
+    print("Solved {} of {} puzzles in {:.3f}s".format(num_solved, len(named_puzzles), time.perf_counter() - start))
@@ -0,0 +1,183 @@
+import argparse
+import json
+import math
+import multiprocessing
+import platform
+import statistics
+from typing import *
+from generator import difficulties, generate_puzzle
+from main import engine_help, engines, solve_puzzle, timeout_help
+
+try:
+    import resource  # peak memory, not available on Windows
+except ImportError:
+    resource = None
+
+
+#====================================================================================
+
+
+def create_cases(sizes: List[int], levels: List[str], count: int, seed: int) -> List[Tuple[int, str, str]]:
+    """Return the (size, difficulty, seed) of every generated puzzle; the seeds only depend on the arguments"""
+    return [(N, difficulty, '{}-{}-{}-{}'.format(seed, N, difficulty, k)) for N in sizes for difficulty in levels for k in range(count)]
+
+
+def run_benchmark(cases: List[Tuple[int, str, str]], engine: str = 'cells', timeout: Optional[float] = None, processes: int = 1) -> List[Dict[str, any]]:
+    """
+    Solve each case in a fresh worker process so that its peak memory is its own. Cases run one at a time unless
+    processes is raised, which makes the timings compete for the cores.
+    """
+    tasks = [(N, difficulty, seed, engine, timeout) for N, difficulty, seed in cases]
+    with multiprocessing.Pool(processes, maxtasksperchild=1) as pool:
+        return pool.map(run_case, tasks, chunksize=1)
+
+
+def run_case(task: Tuple[int, str, str, str, Optional[float]]) -> Dict[str, any]:
+    """Time finding the first solution of one generated puzzle, counting the search nodes through its budget"""
+    N, difficulty, seed, engine, timeout = task
+    puzzle, _ = generate_puzzle(N, difficulty, seed)
+    result = {'size': N, 'difficulty': difficulty, 'seed': seed, 'status': 'error', 'seconds': None, 'nodes': None, 'peak_rss_kb': None}
+    try:
+        solve_result = solve_puzzle(puzzle, engine, time_limit=timeout)
+        result['status'] = solve_result.status
+        if solve_result.status in {'solved', 'unsatisfiable', 'timeout'}:
+            result['seconds'] = solve_result.seconds
+            result['nodes'] = solve_result.nodes
+    except Exception as error:
+        result['error'] = '{}: {}'.format(type(error).__name__, error)
+    if resource is not None:
+        result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # kilobytes on Linux
+    return result
+
+
+def summarize(results: List[Dict[str, any]], timeout: Optional[float] = None) -> List[Dict[str, any]]:
+    """
+    Aggregate the results of each (size, difficulty) group. A timed-out case counts as taking the timeout in the
+    median and p99, since it took at least that long, so that pushing cases past the timeout cannot look faster.
+    """
+    groups = {}
+    for result in results:
+        groups.setdefault((result['size'], result['difficulty']), []).append(result)
+    summaries = []
+    for (N, difficulty), group in groups.items():
+        timed = [result for result in group if result['status'] in {'solved', 'unsatisfiable', 'timeout'}]
+        seconds = sorted(timeout if result['status'] == 'timeout' and timeout is not None else result['seconds'] for result in timed)
+        counted = [result for result in timed if result['nodes'] is not None]
+        counted_seconds = sum(result['seconds'] for result in counted)
+        peak_rss = [result['peak_rss_kb'] for result in group if result['peak_rss_kb'] is not None]
+        summaries.append({
+            'size': N,
+            'difficulty': difficulty,
+            'cases': len(group),
+            'solved': sum(result['status'] == 'solved' for result in group),
+            'timeouts': sum(result['status'] == 'timeout' for result in group),
+            'errors': sum(result['status'] == 'error' for result in group),
+            'median_seconds': statistics.median(seconds) if len(seconds) > 0 else None,
+            'p99_seconds': percentile(seconds, 99) if len(seconds) > 0 else None,
+            'nodes_per_second': sum(result['nodes'] for result in counted) / counted_seconds if counted_seconds > 0 else None,
+            'peak_rss_kb': max(peak_rss) if len(peak_rss) > 0 else None,
+        })
+    return summaries
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def compare_to_baseline(summaries: List[Dict[str, any]], baseline: Dict[str, any]) -> List[str]:
+    """Describe how each group's median time and its solved and timed-out cases changed against an earlier benchmark report"""
+    baseline_summaries = {(summary['size'], summary['difficulty']): summary for summary in baseline['summary']}
+    lines = []
+    for summary in summaries:
+        old = baseline_summaries.get((summary['size'], summary['difficulty']))
+        if old is None or old['median_seconds'] is None or summary['median_seconds'] is None:
+            continue
+        lines.append("{}x{} {}: median {:.4f}s -> {:.4f}s ({:.2f}x), solved {} -> {}, timeouts {} -> {}".format(
+            summary['size'], summary['size'], summary['difficulty'], old['median_seconds'], summary['median_seconds'],
+            old['median_seconds'] / summary['median_seconds'] if summary['median_seconds'] > 0 else float('inf'),
+            old['solved'], summary['solved'], old['timeouts'], summary['timeouts']))
+    return lines
+
+
+#====================================================================================
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the solver on seeded random puzzles of several sizes and difficulties.")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs='+',
+        default=[6, 8, 10],
+        help="Board sizes N to generate puzzles for (the generator supports 6 to 20 and more)."
+    )
+    parser.add_argument(
+        "--difficulties",
+        choices=list(difficulties),
+        nargs='+',
+        default=list(difficulties),
+        help="Difficulty levels, i.e. how many cells are given as hints."
+    )
+    parser.add_argument(
+        "--count",
+        type=int,
+        default=5,
+        help="Puzzles per size and difficulty."
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the puzzle set; the same seed always gives the same puzzles."
+    )
+    parser.add_argument(
+        "--engine",
+        choices=engines,
+        default='cells',
+        help=engine_help
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=10.0,
+        help=timeout_help
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Cases to run at the same time (more than 1 makes the timings noisier)."
+    )
+    parser.add_argument(
+        "--outputfile",
+        type=str,
+        help="File to write the report into as JSON (default: print it)."
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        help="An earlier JSON report to compare the median times against."
+    )
+    args = parser.parse_args()
+
+    cases = create_cases(args.sizes, args.difficulties, args.count, args.seed)
+    results = run_benchmark(cases, args.engine, args.timeout, args.processes)
+    report = {
+        'config': {'sizes': args.sizes, 'difficulties': args.difficulties, 'count': args.count, 'seed': args.seed,
+                   'engine': args.engine, 'timeout': args.timeout, 'python': platform.python_version()},
+        'summary': summarize(results, args.timeout),
+        'cases': results,
+    }
+    if args.outputfile is not None:
+        output_file = open(args.outputfile, "w")
+        output_file.write(json.dumps(report, indent=2) + '\n')
+        output_file.close()
+    else:
+        print(json.dumps(report['summary'], indent=2))
+    if args.baseline is not None:
+        baseline_file = open(args.baseline)
+        baseline = json.load(baseline_file)
+        baseline_file.close()
+        for line in compare_to_baseline(report['summary'], baseline):
+            print(line)
@@ -0,0 +1,73 @@
+import threading
+import time
+from typing import *
+
+
+class SearchLimitReached(Exception):
+    """
+    Raised out of a search when its budget runs out; reason is 'timeout', 'node_limit' or 'cancelled'.
+    """
+
+    def __init__(self, reason: str):
+        Exception.__init__(self, reason)
+        self.reason = reason
+
+
+class CancellationToken:
+    """
+    Lets another thread ask a running search to stop at its next node.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    def is_cancelled(self) -> bool:
+        return self._event.is_set()
+
+
+class SearchBudget:
+    """
+    Wall-clock and node limits for one search, plus an optional cancellation token, all checked at every node. The
+    clock starts with the budget unless an absolute deadline (in time.time() seconds, so that it can be handed to
+    another process) is given instead of a time limit.
+    """
+
+    def __init__(self, time_limit: Optional[float] = None, node_limit: Optional[int] = None, token: Optional[CancellationToken] = None, deadline: Optional[float] = None):
+        if time_limit is not None:
+            deadline = time.time() + time_limit if deadline is None else min(deadline, time.time() + time_limit)
+        self._deadline = deadline
+        self._node_limit = node_limit
+        self._token = token
+        self._nodes = 0
+
+    def get_deadline(self) -> Optional[float]:
+        return self._deadline
+
+    def get_node_limit(self) -> Optional[int]:
+        return self._node_limit
+
+    def get_token(self) -> Optional[CancellationToken]:
+        return self._token
+
+    def get_num_nodes(self) -> int:
+        return self._nodes
+
+    def add_nodes(self, num_nodes: int) -> None:
+        """Count nodes searched elsewhere, e.g. in a worker process; the next check enforces the node limit"""
+        self._nodes += num_nodes
+
+    def charge_node(self) -> None:
+        """Count one search node, raising SearchLimitReached if the budget is used up"""
+        self._nodes += 1
+        self.check()
+
+    def check(self) -> None:
+        if self._node_limit is not None and self._nodes > self._node_limit:
+            raise SearchLimitReached('node_limit')
+        if self._deadline is not None and time.time() >= self._deadline:
+            raise SearchLimitReached('timeout')
+        if self._token is not None and self._token.is_cancelled():
+            raise SearchLimitReached('cancelled')
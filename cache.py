@@ -0,0 +1,164 @@
+import collections
+import functools
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+from typing import *
+from puzzle import Puzzle, format_puzzle
+
+
+class Symmetry(NamedTuple):
+    """
+    One of the 8 symmetries of a square board: an optional transpose, then optional flips of the row and column
+    order. Ship ends change symbol with the board, e.g. a transpose turns '<' into '^'.
+    """
+    transpose: bool
+    flip_rows: bool
+    flip_cols: bool
+
+    def map_cell(self, cell: Tuple[int, int], N: int) -> Tuple[int, int]:
+        i, j = (cell[1], cell[0]) if self.transpose else cell
+        return (N - 1 - i if self.flip_rows else i), (N - 1 - j if self.flip_cols else j)
+
+    def map_symbol(self, symbol: str) -> str:
+        for applies, symbols in zip(self, (transposed_symbols, row_flipped_symbols, col_flipped_symbols)):
+            if applies:
+                symbol = symbols.get(symbol, symbol)
+        return symbol
+
+    def unmap_symbol(self, symbol: str) -> str:
+        for applies, symbols in reversed(list(zip(self, (transposed_symbols, row_flipped_symbols, col_flipped_symbols)))):
+            if applies:
+                symbol = symbols.get(symbol, symbol)
+        return symbol
+
+    def apply(self, puzzle: Puzzle) -> Puzzle:
+        """Return the puzzle as seen after this symmetry"""
+        row_tallies, col_tallies = (puzzle.col_tallies, puzzle.row_tallies) if self.transpose else (puzzle.row_tallies, puzzle.col_tallies)
+        row_tallies = list(reversed(row_tallies)) if self.flip_rows else list(row_tallies)
+        col_tallies = list(reversed(col_tallies)) if self.flip_cols else list(col_tallies)
+        hints = {self.map_cell(cell, puzzle.get_size()): self.map_symbol(symbol) for cell, symbol in puzzle.hints.items()}
+        return Puzzle(row_tallies, col_tallies, dict(puzzle.ship_constraints), hints)
+
+    def undo_on_grid(self, grid: List[str]) -> Dict[Tuple[int, int], any]:
+        """Return the solution, in the original orientation, of the grid lines of a solution to the puzzle after this symmetry"""
+        N = len(grid)
+        solution = {}
+        for i in range(N):
+            for j in range(N):
+                mapped_i, mapped_j = self.map_cell((i, j), N)
+                solution[(i, j)] = self.unmap_symbol(grid[mapped_i][mapped_j])
+        return solution
+
+    def apply_to_solution(self, solution: Dict[Tuple[int, int], any], N: int) -> List[str]:
+        """Return the grid lines of the solution after this symmetry"""
+        grid = [['.'] * N for _ in range(N)]
+        for cell, symbol in solution.items():
+            i, j = self.map_cell(cell, N)
+            grid[i][j] = self.map_symbol(symbol)
+        return [''.join(line) for line in grid]
+
+
+transposed_symbols = {'<': '^', '^': '<', '>': 'v', 'v': '>'}
+row_flipped_symbols = {'^': 'v', 'v': '^'}
+col_flipped_symbols = {'<': '>', '>': '<'}
+symmetries = tuple(Symmetry(transpose, flip_rows, flip_cols) for transpose in (False, True) for flip_rows in (False, True) for flip_cols in (False, True))
+
+
+def canonicalize(puzzle: Puzzle) -> Tuple[str, Symmetry]:
+    """
+    Return the fingerprint of the puzzle's tallies, fleet and hints, the same for all of its mirror images and
+    transposes, with the symmetry that turns the puzzle into the one the fingerprint was taken of
+    """
+    text, symmetry = min(('\n'.join(format_puzzle(symmetry.apply(puzzle))), symmetry) for symmetry in symmetries)
+    return hashlib.sha256(text.encode()).hexdigest(), symmetry
+
+
+#====================================================================================
+
+
+class SolutionCache:
+    """
+    Solutions of earlier puzzles, keyed by canonical fingerprint so that mirror images and transposes of a puzzle
+    share one entry. Each entry holds the solutions found in the canonical orientation and whether they are all of
+    them. The most recently used max_entries entries are kept in memory; with a path, entries are also kept in an
+    SQLite file that worker processes can share.
+    """
+
+    def __init__(self, max_entries: int = 1000, path: Optional[str] = None):
+        self._max_entries = max_entries
+        self._entries = collections.OrderedDict()  # fingerprint -> (complete, grid lines of each solution)
+        self._path = path
+        self._connection = None
+        self._connection_pid = None  # connections must not be shared with forked processes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, puzzle: Puzzle, max_solutions: Optional[int] = 1) -> Optional[List[Dict[Tuple[int, int], any]]]:
+        """Return up to max_solutions solutions of the puzzle, or None if the cache does not know enough of them"""
+        key, symmetry = canonicalize(puzzle)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        if not is_enough(entry, max_solutions) and self._path is not None:
+            # Another process may have found more
+            entry = self._load(key)
+            if entry is not None:
+                self._remember(key, entry)
+        if not is_enough(entry, max_solutions):
+            return None
+        return [symmetry.undo_on_grid(grid) for grid in itertools.islice(entry[1], max_solutions)]
+
+    def put(self, puzzle: Puzzle, solutions: List[Dict[Tuple[int, int], any]], complete: bool) -> None:
+        """Remember the solutions found for the puzzle, complete if they are all of its solutions"""
+        key, symmetry = canonicalize(puzzle)
+        old_entry = self._entries.get(key)
+        if old_entry is not None and (old_entry[0] or len(old_entry[1]) >= len(solutions)) and not complete:
+            return
+        entry = (complete, [symmetry.apply_to_solution(solution, puzzle.get_size()) for solution in solutions])
+        self._remember(key, entry)
+        if self._path is not None:
+            self._store(key, entry)
+
+    def _remember(self, key: str, entry: Tuple[bool, List[List[str]]]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None or self._connection_pid != os.getpid():
+            self._connection = sqlite3.connect(self._path, timeout=30.0)
+            self._connection.execute("CREATE TABLE IF NOT EXISTS solutions (key TEXT PRIMARY KEY, complete INTEGER NOT NULL, num_solutions INTEGER NOT NULL, grids TEXT NOT NULL)")
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def _load(self, key: str) -> Optional[Tuple[bool, List[List[str]]]]:
+        row = self._connect().execute("SELECT complete, grids FROM solutions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return bool(row[0]), json.loads(row[1])
+
+    def _store(self, key: str, entry: Tuple[bool, List[List[str]]]) -> None:
+        # Another process may have stored more in the meantime, so only replace entries that know less
+        complete, grids = entry
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "INSERT INTO solutions VALUES (?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET complete = excluded.complete, "
+                "num_solutions = excluded.num_solutions, grids = excluded.grids "
+                "WHERE excluded.complete OR (NOT solutions.complete AND excluded.num_solutions > solutions.num_solutions)",
+                (key, int(complete), len(grids), json.dumps(grids)))
+
+
+def is_enough(entry: Optional[Tuple[bool, List[List[str]]]], max_solutions: Optional[int]) -> bool:
+    return entry is not None and (entry[0] or (max_solutions is not None and len(entry[1]) >= max_solutions))
+
+
+@functools.lru_cache(maxsize=None)
+def get_shared_cache(path: str) -> SolutionCache:
+    """Return this process's cache on the SQLite file at path, so that the tasks of a worker process share it"""
+    return SolutionCache(path=path)
@@ -1,5 +1,5 @@
 from typing import *
-from csp import Constraint, Variable
+from csp import Constraint, DomainEncoding, Variable
 
 
 class AtLeastOneConstraint(Constraint):
@@ -12,6 +12,9 @@ class AtLeastOneConstraint(Constraint):
         self._name = "AtLeastOneConstraint_" + name
         self._required_value = required_value
 
+    def get_required_value(self) -> any:
+        return self._required_value
+
     def is_satisfied(self) -> bool:
         for variable in self.get_target_variables():
             if variable.is_assigned():
@@ -34,43 +37,95 @@ class AtLeastOneConstraint(Constraint):
             return False
 
 
+class SupportTable:
+    """
+    Precompiled supports of a binary table, shared by every table constraint with the same tuples and domains.
+    """
+    _tables = dict()
+
+    def __init__(self, satisfying_tuples: FrozenSet[Tuple[any, any]], encodings: Tuple[DomainEncoding, DomainEncoding]):
+        self._satisfying_tuples = satisfying_tuples
+        self._encodings = encodings
+
+        # For each position and value, the mask of values of the other variable that support it
+        self._value_supports = ({}, {})
+        for value_1, value_2 in satisfying_tuples:
+            bit_1, bit_2 = encodings[0].get_bit(value_1), encodings[1].get_bit(value_2)
+            self._value_supports[0][bit_1] = self._value_supports[0].get(bit_1, 0) | bit_2
+            self._value_supports[1][bit_2] = self._value_supports[1].get(bit_2, 0) | bit_1
+        self._supported_masks = ({}, {})  # position -> {other variable's mask -> mask of supported values}, filled in lazily
+
+    @staticmethod
+    def of(satisfying_tuples: Iterable[Tuple[any, any]], encodings: Tuple[DomainEncoding, DomainEncoding]) -> 'SupportTable':
+        key = (frozenset(satisfying_tuples), encodings)
+        if key not in SupportTable._tables:
+            SupportTable._tables[key] = SupportTable(key[0], encodings)
+        return SupportTable._tables[key]
+
+    def get_satisfying_tuples(self) -> FrozenSet[Tuple[any, any]]:
+        return self._satisfying_tuples
+
+    def get_value_supports(self, position: int, bit: int) -> int:
+        return self._value_supports[position].get(bit, 0)
+
+    def get_supported_mask(self, position: int, other_mask: int) -> int:
+        """Return the mask of values at position that have a support among the other variable's values"""
+        supported_mask = self._supported_masks[position].get(other_mask)
+        if supported_mask is None:
+            supported_mask = 0
+            for bit, supports in self._value_supports[position].items():
+                if supports & other_mask:
+                    supported_mask |= bit
+            self._supported_masks[position][other_mask] = supported_mask
+        return supported_mask
+
+
 class TableConstraint(Constraint):
     """
-    Table constraint over a set of variables.
+    Table constraint over a pair of variables, given the value pairs that satisfy it in target variable order.
     """
 
-    def __init__(self, name: str, target_variables: Set[Variable], satisfying_assignments: List[Dict[Variable, any]]):
-        Constraint.__init__(self, name, target_variables)
+    def __init__(self, name: str, target_variables: Tuple[Variable, Variable], satisfying_tuples: Iterable[Tuple[any, any]]):
+        Constraint.__init__(self, name, tuple(target_variables))
         self._name = "TableConstraint_" + name
-        self._satisfying_assignments = satisfying_assignments
+        encodings = (target_variables[0].get_encoding(), target_variables[1].get_encoding())
+        self._support_table = SupportTable.of(satisfying_tuples, encodings)
 
-    def is_satisfied(self) -> bool:
-        assignment = {}
-        for variable in self.get_target_variables():
-            if variable.is_assigned():
-                assignment.update({variable: variable.get_value()})
-            else:
-                return True
+    def get_support_table(self) -> SupportTable:
+        return self._support_table
 
-        return assignment in self._satisfying_assignments
+    def is_satisfied(self) -> bool:
+        variable_1, variable_2 = self.get_target_variables()
+        if not variable_1.is_assigned() or not variable_2.is_assigned():
+            return True
+        return (variable_1.get_value(), variable_2.get_value()) in self._support_table.get_satisfying_tuples()
 
     def has_support(self, variable: Variable, value) -> bool:
         if variable not in self.get_target_variables():
             return True
 
-        found_satisfying_assignment = False
-        for assignment in self._satisfying_assignments:
-            if assignment[variable] != value:
-                continue
-            found_satisfying_assignment = True
-            for other_variable in self.get_target_variables():
-                if other_variable != variable and not other_variable.value_in_curr_domain(assignment[other_variable]):
-                    found_satisfying_assignment = False
-                    break
-            if found_satisfying_assignment:
-                break
+        position = 0 if variable is self.get_target_variables()[0] else 1
+        other_variable = self.get_target_variables()[1 - position]
+        supports = self._support_table.get_value_supports(position, variable.get_encoding().get_bit(value))
+        return supports & other_variable.get_curr_domain_mask() != 0
 
-        return found_satisfying_assignment
+    def count_supports(self, variable: Variable, value) -> int:
+        """Return how many values of the other variable's current domain would stay supported if variable took value"""
+        position = 0 if variable is self.get_target_variables()[0] else 1
+        other_variable = self.get_target_variables()[1 - position]
+        supports = self._support_table.get_value_supports(position, variable.get_encoding().get_bit(value))
+        return (supports & other_variable.get_curr_domain_mask()).bit_count()
+
+    def revise(self, variable: Variable) -> bool:
+        position = 0 if variable is self.get_target_variables()[0] else 1
+        other_variable = self.get_target_variables()[1 - position]
+        mask = variable.get_curr_domain_mask()
+        new_mask = mask & self._support_table.get_supported_mask(position, other_variable.get_curr_domain_mask())
+        if new_mask == 0:
+            return False
+        if new_mask != mask:
+            variable.set_curr_domain_mask(new_mask)
+        return True
 
 
 class NValuesConstraint(Constraint):
@@ -84,6 +139,7 @@ class NValuesConstraint(Constraint):
         self._required_values = required_values
         self._lower_bound = lower_bound
         self._upper_bound = upper_bound
+        self._required_masks = {}  # domain encoding -> mask of the required values
 
     def is_satisfied(self) -> bool:
         assignments = {}
@@ -100,31 +156,232 @@ class NValuesConstraint(Constraint):
 
         return self._lower_bound <= required_value_count <= self._upper_bound
 
+    def get_required_values(self) -> Set[any]:
+        return self._required_values
+
+    def get_bounds(self) -> Tuple[int, int]:
+        return self._lower_bound, self._upper_bound
+
     def has_support(self, variable: Variable, value) -> bool:
         if variable not in self.get_target_variables():
             return True
 
-        def check_assignments(assignment: Dict[Variable, any]):
-            required_value_count = 0
-            for variable in assignment:
-                if assignment[variable] in self._required_values:
-                    required_value_count += 1
-            most = required_value_count + self.get_num_target_variables() - len(assignment)
-            least = required_value_count
-            return self._lower_bound <= most and self._upper_bound >= least
-        variables_to_assign = list(self.get_target_variables())
-        variables_to_assign.remove(variable)
-        variables_to_assign.sort(reverse=True, key=lambda variable: variable.get_curr_domain_size())
-        return self._find_support(variables_to_assign, {variable: value}, check_assignments, check_assignments)
-
-    def _find_support(self, remaining_variables: List[Variable], assignment: Dict[Variable, any], final_test, partial_test) -> bool:
-        if len(remaining_variables) == 0:
-            return final_test(assignment)
-        variable = remaining_variables.pop()  # pop the variable with the smallest domain size
-        for value in variable.get_curr_domain():
-            assignment.update({variable: value})
-            if partial_test(assignment) and self._find_support(remaining_variables, assignment, final_test, partial_test):
+        # The other variables can reach any count between those that must and those that may take a required value
+        must_count, may_count = self.count_required_values(excluded_variable=variable)
+        if value in self._required_values:
+            must_count, may_count = must_count + 1, may_count + 1
+        return must_count <= self._upper_bound and may_count >= self._lower_bound
+
+    def count_required_values(self, excluded_variable: Variable = None) -> Tuple[int, int]:
+        """Return how many target variables must take a required value and how many still may"""
+        must_count, may_count = 0, 0
+        for variable in self.get_target_variables():
+            if variable is excluded_variable:
+                continue
+            required_mask = self._get_required_mask(variable)
+            mask = variable.get_curr_domain_mask()
+            if mask & required_mask:
+                may_count += 1
+                if not mask & ~required_mask:
+                    must_count += 1
+        return must_count, may_count
+
+    def propagate(self, changed_variable: Optional[Variable]) -> bool:
+        """Make the tally bound consistent, returning False if it can no longer be met"""
+        must_count, may_count = self.count_required_values()
+        if must_count > self._upper_bound or may_count < self._lower_bound:
+            return False
+
+        # Once a bound is reached, every undecided variable is forced to the other side
+        if must_count == self._upper_bound or may_count == self._lower_bound:
+            for variable in self.get_target_variables():
+                required_mask = self._get_required_mask(variable)
+                mask = variable.get_curr_domain_mask()
+                if mask & required_mask and mask & ~required_mask:
+                    if must_count == self._upper_bound:
+                        variable.set_curr_domain_mask(mask & ~required_mask)
+                    else:
+                        variable.set_curr_domain_mask(mask & required_mask)
+        return True
+
+    def _get_required_mask(self, variable: Variable) -> int:
+        encoding = variable.get_encoding()
+        if encoding not in self._required_masks:
+            self._required_masks[encoding] = encoding.get_mask(self._required_values)
+        return self._required_masks[encoding]
+
+
+class ShipPatterns(NamedTuple):
+    """
+    The ship placements of every length up to max_length on a grid, plus every head followed by enough middles to
+    make a ship too long (as length 0), indexed by cell; see find_ship_patterns.
+    """
+    max_length: int
+    cells: Tuple[Variable, ...]
+    lengths: List[int]  # pattern -> its ship length
+    sizes: List[int]  # pattern -> its number of cells
+    patterns_of_each_cell: List[List[Tuple[int, int]]]  # cell -> (pattern, bit of its value in the pattern)
+
+
+class FleetConstraint(Constraint):
+    """
+    Fleet constraint over a grid of variables, counting the ships of each length. It keeps, for every ship placement,
+    how many of its cells exclude its value or are not yet decided to it, updating only the placements over the cells
+    that changed since the last call.
+    """
+
+    def __init__(self, name: str, row_list: List[List[Variable]], required_ships: Dict[int, int], patterns: Optional[ShipPatterns] = None):
+        Constraint.__init__(self, name, {variable for row in row_list for variable in row})
+        self._name = "FleetConstraint_" + name
+        self._required_ships = required_ships
+        self._max_length = max(required_ships)
+
+        # The patterns only depend on the grid, so callers may pass in ones computed earlier. Every length up to the
+        # longest is tracked, as no ship type may be completed more often than required.
+        if patterns is None:
+            patterns = find_ship_patterns(row_list, self._max_length)
+        assert patterns.max_length == self._max_length
+        self._patterns = patterns
+        self._masks = None  # the cells' current domain masks as of the last call, None until the first
+        self._num_blocked = None  # pattern -> number of its cells whose current domain excludes its value
+        self._num_undecided = None  # pattern -> number of its cells whose current domain is not just its value
+        self._num_possible = None  # length -> number of placements with no blocked cell
+        self._num_completed = None  # length -> number of placements with every cell decided (0: overlong starts)
+
+    def is_satisfied(self) -> bool:
+        for variable in self.get_target_variables():
+            if not variable.is_assigned():
                 return True
-            del assignment[variable]  # this assignment won't work
-        remaining_variables.append(variable)
-        return False
+
+        completed_ships = self.count_completed_ships()
+        if completed_ships is None:
+            return False
+        for length in completed_ships:
+            if completed_ships[length] != self._required_ships.get(length, 0):
+                return False
+        return True
+
+    def has_support(self, variable: Variable, value) -> bool:
+        # The fleet is only checked as a whole, see can_be_satisfied
+        return True
+
+    def is_global(self) -> bool:
+        return True
+
+    def propagate(self, changed_variable: Optional[Variable]) -> bool:
+        return self.can_be_satisfied()
+
+    def can_be_satisfied(self, masks: Optional[List[int]] = None) -> bool:
+        """
+        Return False if the current domains can no longer contain the required fleet. Callers that already have the
+        cells' current domain masks, in row order, may pass them in.
+        """
+        self._update_counts(masks)
+
+        # No ship type may be completed more often than required, nor any ship be too long
+        if self._num_completed[0] > 0:
+            return False
+        for length in range(1, self._max_length + 1):
+            if self._num_completed[length] > self._required_ships.get(length, 0):
+                return False
+
+        # Every ship type must still fit in enough places (completed ships count as their own place)
+        for length in self._required_ships:
+            if self._num_possible[length] < self._required_ships[length]:
+                return False
+        return True
+
+    def count_completed_ships(self) -> Optional[Dict[int, int]]:
+        """Return the number of fully decided ships of each length, or None if some ship is too long"""
+        self._update_counts()
+        if self._num_completed[0] > 0:
+            return None
+        return {length: self._num_completed[length] for length in range(1, self._max_length + 1)}
+
+    def _update_counts(self, masks: Optional[List[int]] = None) -> None:
+        # Update the counts for the cells whose masks changed since the last call, whether they shrank or were undone.
+        # A cell decided to one value is as good as assigned it, as every solution from here on has that value there.
+        patterns = self._patterns
+        if masks is None:
+            masks = list(map(Variable.get_curr_domain_mask, patterns.cells))
+        if self._masks is None:
+            self._num_blocked = list(patterns.sizes)
+            self._num_undecided = list(patterns.sizes)
+            self._num_possible = [0] * (self._max_length + 1)
+            self._num_completed = [0] * (self._max_length + 1)
+            self._masks = [0] * len(masks)  # as if every cell had an empty domain, matching the counts above
+        if masks == self._masks:
+            return
+        num_blocked, num_undecided = self._num_blocked, self._num_undecided
+        num_possible, num_completed = self._num_possible, self._num_completed
+        lengths, patterns_of_each_cell = patterns.lengths, patterns.patterns_of_each_cell
+        for k, (old_mask, new_mask) in enumerate(zip(self._masks, masks)):
+            if old_mask == new_mask:
+                continue
+            for p, bit in patterns_of_each_cell[k]:
+                was_allowed, is_allowed = old_mask & bit != 0, new_mask & bit != 0
+                if was_allowed != is_allowed:
+                    if is_allowed:
+                        num_blocked[p] -= 1
+                        if num_blocked[p] == 0:
+                            num_possible[lengths[p]] += 1
+                    else:
+                        if num_blocked[p] == 0:
+                            num_possible[lengths[p]] -= 1
+                        num_blocked[p] += 1
+                was_decided, is_decided = old_mask == bit, new_mask == bit
+                if was_decided != is_decided:
+                    if is_decided:
+                        num_undecided[p] -= 1
+                        if num_undecided[p] == 0:
+                            num_completed[lengths[p]] += 1
+                    else:
+                        if num_undecided[p] == 0:
+                            num_completed[lengths[p]] -= 1
+                        num_undecided[p] += 1
+        self._masks = masks
+
+
+def find_ship_patterns(row_list: List[List[Variable]], max_length: int) -> ShipPatterns:
+    """Return the ship patterns of the grid for ships up to max_length long"""
+    patterns = [(0, placement) for placement in find_overlong_ship_starts(row_list, max_length)]
+    for length in range(1, max_length + 1):
+        patterns.extend((length, placement) for placement in find_ship_placements(row_list, length))
+    cells = tuple(variable for row in row_list for variable in row)
+    indices = {variable: k for k, variable in enumerate(cells)}
+    patterns_of_each_cell = [[] for _ in cells]
+    for p, (_, placement) in enumerate(patterns):
+        for variable, value in placement:
+            patterns_of_each_cell[indices[variable]].append((p, variable.get_encoding().get_bit(value)))
+    return ShipPatterns(max_length, cells, [length for length, _ in patterns], [len(placement) for _, placement in patterns], patterns_of_each_cell)
+
+
+def find_ship_placements(row_list: List[List[Variable]], length: int) -> List[List[Tuple[Variable, any]]]:
+    """Return every way of laying a ship of the given length on the grid as (variable, value) pairs"""
+    placements = []
+    N = len(row_list)
+    for i in range(N):
+        for j in range(N):
+            if length == 1:
+                placements.append([(row_list[i][j], 'S')])
+                continue
+            if j + length <= N:
+                values = ['<'] + ['M'] * (length - 2) + ['>']
+                placements.append([(row_list[i][j + k], values[k]) for k in range(length)])
+            if i + length <= N:
+                values = ['^'] + ['M'] * (length - 2) + ['v']
+                placements.append([(row_list[i + k][j], values[k]) for k in range(length)])
+    return placements
+
+
+def find_overlong_ship_starts(row_list: List[List[Variable]], max_length: int) -> List[List[Tuple[Variable, any]]]:
+    """Return every way of laying a ship head followed by max_length - 1 middles, which no ship of max_length fits"""
+    placements = []
+    N = len(row_list)
+    for i in range(N):
+        for j in range(N):
+            if j + max_length <= N:
+                placements.append([(row_list[i][j], '<')] + [(row_list[i][j + k], 'M') for k in range(1, max_length)])
+            if i + max_length <= N:
+                placements.append([(row_list[i][j], '^')] + [(row_list[i + k][j], 'M') for k in range(1, max_length)])
+    return placements
@@ -1,89 +1,289 @@
+import collections
+import random
+import sys
+import time
 from typing import *
 from abc import abstractmethod
 
 
+class DomainEncoding:
+    """
+    Bit assignment for the values of a domain, shared by all variables with that domain.
+    """
+    _encodings = dict()
+
+    def __init__(self, values: Tuple[any, ...]):
+        self._values = values
+        self._bits = {value: 1 << i for i, value in enumerate(values)}
+        self._full_mask = (1 << len(values)) - 1
+        self._decoded = dict()  # mask -> tuple of values, filled in lazily
+
+    @staticmethod
+    def of(domain: Iterable) -> 'DomainEncoding':
+        # Sets are ordered by value so that the encoding does not depend on hash seeding
+        values = tuple(sorted(domain, key=str)) if isinstance(domain, (set, frozenset)) else tuple(dict.fromkeys(domain))
+        if values not in DomainEncoding._encodings:
+            DomainEncoding._encodings[values] = DomainEncoding(values)
+        return DomainEncoding._encodings[values]
+
+    def get_values(self) -> Tuple[any, ...]:
+        return self._values
+
+    def get_full_mask(self) -> int:
+        return self._full_mask
+
+    def get_bit(self, value) -> int:
+        return self._bits.get(value, 0)
+
+    def get_mask(self, values: Iterable) -> int:
+        mask = 0
+        for value in values:
+            mask |= self._bits.get(value, 0)
+        return mask
+
+    def decode(self, mask: int) -> Tuple[any, ...]:
+        values = self._decoded.get(mask)
+        if values is None:
+            values = tuple(value for value in self._values if mask & self._bits[value])
+            self._decoded[mask] = values
+        return values
+
+
 class Variable:
     """
-    Class for defining CSP variables.
+    Class for defining CSP variables. The current domain is kept as a bitmask over the domain's values. When the CSP
+    records explanations, the variable also keeps the set of decision levels (as a bitmask) that its current domain
+    depends on.
     """
-    undo_dict = dict()
+    __slots__ = ('_name', '_domain', '_encoding', '_value', '_curr_domain_mask', '_explanation', '_ordering', '_trail')
 
-    def __init__(self, name: any, domain: set):
+    def __init__(self, name: any, domain: Iterable):
         self._name = name
         self._domain = domain
+        self._encoding = DomainEncoding.of(domain)
         self._value = None
-        self._curr_domain = domain.copy()
+        self._curr_domain_mask = self._encoding.get_full_mask()
+        self._explanation = 0
+        self._ordering = None  # set by the CSP that owns this variable
+        self._trail = None  # set by the CSP that owns this variable
 
     def get_name(self) -> any:
         return self._name
 
-    def get_domain(self) -> set:
+    def get_domain(self) -> Iterable:
         return self._domain
 
     def get_domain_size(self) -> int:
-        return len(self._domain)
+        return len(self._encoding.get_values())
+
+    def get_encoding(self) -> DomainEncoding:
+        return self._encoding
 
     def get_value(self):
         return self._value
 
     def set_value(self, value) -> None:
-        assert value in self._domain
+        assert self._encoding.get_bit(value)
         self._value = value
+        if self._ordering is not None:
+            self._ordering.update(self)
 
     def unassign(self) -> None:
         self._value = None
+        if self._ordering is not None:
+            self._ordering.update(self)
+
+    def set_ordering(self, ordering: 'VariableOrdering') -> None:
+        self._ordering = ordering
+
+    def set_trail(self, trail: 'Trail') -> None:
+        self._trail = trail
 
     def is_assigned(self) -> bool:
         return self._value is not None
 
-    def get_curr_domain(self) -> set:
-        if self.is_assigned():
-            return {self.get_value()}
-        else:
-            return self._curr_domain
+    def get_curr_domain(self) -> Tuple[any, ...]:
+        if self._value is not None:
+            return (self._value,)
+        return self._encoding.decode(self._curr_domain_mask)
+
+    def get_curr_domain_mask(self) -> int:
+        if self._value is not None:
+            return self._encoding.get_bit(self._value)
+        return self._curr_domain_mask
 
     def get_curr_domain_size(self) -> int:
-        if self.is_assigned():
+        if self._value is not None:
             return 1
-        return len(self._curr_domain)
+        return len(self._encoding.decode(self._curr_domain_mask))
 
     def value_in_curr_domain(self, value) -> bool:
-        if self.is_assigned():
-            return value == self.get_value()
-        return value in self._curr_domain
-
-    def remove_value_from_curr_domain(self, value, reason_variable, reason_value) -> None:
-        assert value in self._curr_domain
-        self._curr_domain.remove(value)
-        key = (reason_variable, reason_value)
-        if key not in Variable.undo_dict:
-            Variable.undo_dict[key] = []
-        Variable.undo_dict[key].append((self, value))
-
-    def restore_value(self, value) -> None:
-        self._curr_domain.add(value)
+        if self._value is not None:
+            return value == self._value
+        return self._curr_domain_mask & self._encoding.get_bit(value) != 0
+
+    def remove_value_from_curr_domain(self, value) -> None:
+        bit = self._encoding.get_bit(value)
+        assert self._curr_domain_mask & bit
+        self.set_curr_domain_mask(self._curr_domain_mask & ~bit)
+
+    def set_curr_domain_mask(self, mask: int) -> None:
+        """Shrink the current domain to the values in mask, recording the change on the trail"""
+        if self._trail is not None:
+            self._trail.push(self, self._curr_domain_mask, self._explanation)
+        self._curr_domain_mask = mask
+        if self._ordering is not None:
+            self._ordering.update(self)
+
+    def mark_trail(self) -> None:
+        """Push the current domain on the trail unchanged, so that the trail moves on past an assignment"""
+        if self._trail is not None:
+            self._trail.push(self, self._curr_domain_mask, self._explanation)
+
+    def restore_curr_domain_mask(self, mask: int, explanation: int = 0) -> None:
+        self._curr_domain_mask = mask
+        self._explanation = explanation
+        if self._ordering is not None:
+            self._ordering.update(self)
+
+    def get_explanation(self) -> int:
+        return self._explanation
+
+    def set_explanation(self, explanation: int) -> None:
+        """Set the decision levels the current domain depends on; undone together with the domain change it explains"""
+        self._explanation = explanation
 
     def restore_curr_domain(self) -> None:
-        self._curr_domain = self._domain
+        self.restore_curr_domain_mask(self._encoding.get_full_mask())
 
     def reset(self) -> None:
         self.restore_curr_domain()
         self.unassign()
 
     def print_variable(self):
-        print("Variable\"{} = {}\": Dom = {}, CurDom = {}".format(self._name, self._value, self._domain, self._curr_domain))
+        print("Variable\"{} = {}\": Dom = {}, CurDom = {}".format(self._name, self._value, self._domain, set(self.get_curr_domain())))
 
-    @staticmethod
-    def clear_undo_dict():
-        Variable.undo_dict = dict()
 
-    @staticmethod
-    def restore_values(reason_variable, reason_value):
-        key = (reason_variable, reason_value)
-        if key in Variable.undo_dict:
-            for (variable, value) in Variable.undo_dict[key]:
-                variable.restore_value(value)
-            del Variable.undo_dict[key]
+class Trail:
+    """
+    Flat stack of (variable, previous current domain mask, previous explanation) entries that can be undone back to
+    a checkpoint.
+    """
+    __slots__ = ('_entries',)
+
+    def __init__(self):
+        self._entries = []
+
+    def push(self, variable: Variable, mask: int, explanation: int) -> None:
+        self._entries.append(variable)
+        self._entries.append(mask)
+        self._entries.append(explanation)
+
+    def checkpoint(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def get_changed_variables(self, checkpoint: int) -> List[Variable]:
+        """Return the variables whose current domains changed since the checkpoint, with repeats"""
+        return self._entries[checkpoint::3]
+
+    def get_changes(self, checkpoint: int) -> Iterator[Tuple[Variable, int]]:
+        """Return the (variable, previous mask) entries pushed since the checkpoint, oldest first"""
+        return zip(self._entries[checkpoint::3], self._entries[checkpoint + 1::3])
+
+    def get_checkpointed_changes(self, checkpoint: int) -> Iterator[Tuple[int, Variable]]:
+        """Return the (checkpoint just before it, variable) of each entry pushed since the checkpoint, oldest first"""
+        return zip(range(checkpoint, len(self._entries), 3), self._entries[checkpoint::3])
+
+    def undo_to(self, checkpoint: int) -> None:
+        """Restore every current domain changed since the checkpoint, most recent change first"""
+        entries = self._entries
+        while len(entries) > checkpoint:
+            explanation = entries.pop()
+            mask = entries.pop()
+            entries.pop().restore_curr_domain_mask(mask, explanation)
+
+
+class NogoodStore:
+    """
+    Bounded store of nogoods, sets of (variable, value) decisions that cannot all hold in a solution. Each nogood is
+    watched by the decision it was learned at, and once the store is full the least recently used one is evicted.
+    """
+
+    def __init__(self, max_nogoods: int = 10000):
+        self._max_nogoods = max_nogoods
+        self._nogoods = collections.OrderedDict()  # nogood -> its watched decision, least recently used first
+        self._watches = {}  # decision -> nogoods watched by it, in the order they were learned
+
+    def __len__(self) -> int:
+        return len(self._nogoods)
+
+    def add(self, nogood: FrozenSet[Tuple[Variable, any]], watch: Tuple[Variable, any]) -> None:
+        if nogood in self._nogoods:
+            self._nogoods.move_to_end(nogood)
+            return
+        if len(self._nogoods) >= self._max_nogoods:
+            evicted, evicted_watch = self._nogoods.popitem(last=False)
+            self._watches[evicted_watch].pop(evicted, None)
+        self._nogoods[nogood] = watch
+        self._watches.setdefault(watch, {})[nogood] = None
+
+    def find_violated(self, variable: Variable, value: any) -> Optional[FrozenSet[Tuple[Variable, any]]]:
+        """Return a nogood that assigning value to variable would complete, given the current assignment"""
+        for nogood in self._watches.get((variable, value), ()):
+            if all(other.get_value() == other_value for other, other_value in nogood if other is not variable):
+                self._nogoods.move_to_end(nogood)
+                return nogood
+        return None
+
+
+class VariableOrdering:
+    """
+    Index of the unassigned variables of a CSP bucketed by current domain size and degree.
+    """
+
+    def __init__(self, variables: Iterable[Variable], degrees: Dict[Variable, int]):
+        self._degrees = degrees
+        self._degrees_descending = sorted(set(degrees.values()), reverse=True)
+        self._buckets = {}  # (domain size, degree) -> unassigned variables, kept in insertion order
+        self._size_counts = {}  # domain size -> number of unassigned variables with that domain size
+        self._keys = {}  # variable -> its current bucket
+        for variable in variables:
+            self.update(variable)
+
+    def update(self, variable: Variable) -> None:
+        """Move the variable to the bucket matching its current state"""
+        old_key = self._keys.get(variable)
+        new_key = None if variable.is_assigned() else (variable.get_curr_domain_size(), self._degrees[variable])
+        if old_key == new_key:
+            return
+        if old_key is not None:
+            del self._buckets[old_key][variable]
+            self._size_counts[old_key[0]] -= 1
+            del self._keys[variable]
+        if new_key is not None:
+            if new_key not in self._buckets:
+                self._buckets[new_key] = {}
+            self._buckets[new_key][variable] = None
+            self._size_counts[new_key[0]] = self._size_counts.get(new_key[0], 0) + 1
+            self._keys[variable] = new_key
+
+    def select(self, rng: Optional[random.Random] = None) -> Optional[Variable]:
+        """
+        Return the unassigned variable with the smallest current domain, breaking ties by highest degree and then by
+        the order the variables got there, or at random if rng is given
+        """
+        for size in sorted(self._size_counts):
+            if self._size_counts[size] > 0:
+                for degree in self._degrees_descending:
+                    bucket = self._buckets.get((size, degree))
+                    if bucket:
+                        if rng is not None:
+                            return rng.choice(sorted(bucket, key=Variable.get_name))
+                        return next(iter(bucket))
+        return None
 
 
 class Constraint:
@@ -92,6 +292,9 @@ class Constraint:
     """
 
     def __init__(self, name: str, target_variables: Set[Variable]):
+        if isinstance(target_variables, (set, frozenset)):
+            # Sets of variables iterate in memory order, so fix an order to keep propagation reproducible
+            target_variables = tuple(sorted(target_variables, key=Variable.get_name))
         self._target_variables = target_variables
         self._name = "generic_constraint_" + name  # override in subconstraint types!
 
@@ -125,6 +328,31 @@ class Constraint:
     def has_support(self, variable: Variable, value) -> bool:
         pass
 
+    def is_global(self) -> bool:
+        """Global constraints span much of the CSP and are propagated after the local ones have reduced the domains"""
+        return False
+
+    def propagate(self, changed_variable: Optional[Variable]) -> bool:
+        """Revise the other target variables after changed_variable (or any variable, if None) changed, returning False on a wipeout"""
+        for variable in self._target_variables:
+            if variable is not changed_variable and not variable.is_assigned():
+                if not self.revise(variable):
+                    return False
+        return True
+
+    def revise(self, variable: Variable) -> bool:
+        """Remove the values of variable that have no support in this constraint, returning False if none is left"""
+        mask = variable.get_curr_domain_mask()
+        new_mask = mask
+        for value in variable.get_curr_domain():
+            if not self.has_support(variable, value):
+                new_mask &= ~variable.get_encoding().get_bit(value)
+        if new_mask == 0:
+            return False
+        if new_mask != mask:
+            variable.set_curr_domain_mask(new_mask)
+        return True
+
 
 class CSP:
     """
@@ -133,38 +361,226 @@ class CSP:
 
     def __init__(self, name: str, variables: Set[Variable], constraints: Set[Constraint]):
         self._name = name
-        self._variables = variables
+        self._variables = tuple(sorted(variables, key=Variable.get_name))  # in a fixed order, see _index_constraints
         self._constraints = constraints
 
         # Know which constraints each variable is involved in
-        self._constraints_of_each_variable = {variable: set() for variable in variables}
-        for constraint in constraints:
-            for variable in constraint.get_target_variables():
-                self._constraints_of_each_variable[variable].add(constraint)
+        self._constraints_of_each_variable = self._index_constraints({variable: [] for variable in variables}, constraints)
 
         # Make sure constraints do not use out-of-scope variables
         variables_in_constraints = set()
         for constraint in constraints:
-            variables_in_constraints = variables_in_constraints.union(constraint.get_target_variables())
+            variables_in_constraints.update(constraint.get_target_variables())
         for variable in variables:
             if variable not in variables_in_constraints:
-                print("Warning: variable {} is not in any constraint of the CSP {}".format(variable.get_name(), self._name))
+                print("Warning: variable {} is not in any constraint of the CSP {}".format(variable.get_name(), self._name), file=sys.stderr)
         for variable in variables_in_constraints:
             assert variable in variables
 
+        self._create_search_state()
+
+    def _create_search_state(self) -> None:
+        # Keep the unassigned variables ordered by domain size as their domains change, and record changes for undo
+        degrees = {variable: len(self._constraints_of_each_variable[variable]) for variable in self._variables}
+        self._ordering = VariableOrdering(self._variables, degrees)
+        self._trail = Trail()
+        self._stats = None
+        self._budget = None
+        self._explaining = False
+        self._conflict = 0
+        self._value_ordering = None
+        self._tie_breaking = None
+        self._propagator = None
+        for variable in self._variables:
+            variable.set_ordering(self._ordering)
+            variable.set_trail(self._trail)
+
+    def extend(self, name: str, constraints: Set[Constraint]) -> 'CSP':
+        """
+        Return a new CSP over the same variables with extra constraints, reusing this CSP's constraint index. The
+        variables are handed over to the new CSP, so this one must not be searched any more while it is in use.
+        """
+        csp = CSP.__new__(CSP)
+        csp._name = name
+        csp._variables = self._variables
+        csp._constraints = self._constraints | constraints
+        csp._constraints_of_each_variable = csp._index_constraints({variable: list(self._constraints_of_each_variable[variable]) for variable in self._variables}, constraints)
+        csp._create_search_state()
+        return csp
+
+    @staticmethod
+    def _index_constraints(constraints_of_each_variable: Dict[Variable, List[Constraint]], constraints: Iterable[Constraint]) -> Dict[Variable, Tuple[Constraint, ...]]:
+        # Constraints are kept ordered by name rather than in sets, which iterate in memory order, so that the
+        # propagation queues and with them the variable ordering's ties are the same in every run
+        for constraint in constraints:
+            for variable in constraint.get_target_variables():
+                constraints_of_each_variable[variable].append(constraint)
+        return {variable: tuple(sorted(constraints_of_each_variable[variable], key=Constraint.get_name)) for variable in constraints_of_each_variable}
+
     def get_name(self) -> str:
         return self._name
 
-    def get_variables(self) -> Set[Variable]:
+    def get_variables(self) -> Tuple[Variable, ...]:
         return self._variables
 
     def get_constraints(self) -> Set[Constraint]:
         return self._constraints
 
-    def get_constraints_of_variable(self, variable: Variable) -> Set[Constraint]:
-        assert variable in self._variables
+    def get_constraints_of_variable(self, variable: Variable) -> Tuple[Constraint, ...]:
+        assert variable in self._constraints_of_each_variable
         return self._constraints_of_each_variable[variable]
 
+    def get_stats(self) -> Optional['SolverStats']:
+        return self._stats
+
+    def set_stats(self, stats: Optional['SolverStats']) -> None:
+        """Attach a stats.SolverStats to be filled in by the search and propagation, or None to stop collecting"""
+        self._stats = stats
+
+    def get_budget(self) -> Optional['SearchBudget']:
+        return self._budget
+
+    def set_budget(self, budget: Optional['SearchBudget']) -> None:
+        """Attach a budget.SearchBudget that the search charges for every node, or None for an unlimited search"""
+        self._budget = budget
+
+    def set_value_ordering(self, value_ordering: Optional[Callable[['CSP', Variable], Sequence[any]]]) -> None:
+        """Set the function that orders a variable's current domain for the search, or None for the domain's order"""
+        self._value_ordering = value_ordering
+
+    def order_values(self, variable: Variable) -> Sequence[any]:
+        """Return the values of the variable's current domain in the order the search should try them"""
+        if self._value_ordering is None:
+            return variable.get_curr_domain()
+        return self._value_ordering(self, variable)
+
+    def set_explaining(self, explaining: bool) -> None:
+        """
+        Record explanations while propagating: every pruned variable's explanation gains the explanations of the
+        variables of the constraint that pruned it, and a failed propagate leaves the explanations of the failed
+        constraint's variables as the conflict. Searches that set decision levels as explanations can backjump on it.
+        """
+        self._explaining = explaining
+
+    def get_conflict(self) -> int:
+        """Return the decision levels, as a bitmask, that the last failed propagate depended on"""
+        return self._conflict
+
+    def set_tie_breaking(self, rng: Optional[random.Random]) -> None:
+        """Break ties between equally good variables at random with rng, or by a fixed order if None"""
+        self._tie_breaking = rng
+
+    def select_unassigned_variable(self) -> Optional[Variable]:
+        """Return the next variable to assign (smallest current domain, then highest degree), or None if all are assigned"""
+        return self._ordering.select(self._tie_breaking)
+
+    def set_propagator(self, propagator: Optional['GridPropagator']) -> None:
+        """Hand propagate over to another backend such as gridprop.GridPropagator, or None for the constraint objects"""
+        self._propagator = propagator
+
+    def checkpoint(self) -> int:
+        """Mark the current domains so that later removals can be undone with undo_to"""
+        return self._trail.checkpoint()
+
+    def undo_to(self, checkpoint: int) -> None:
+        self._trail.undo_to(checkpoint)
+        if self._propagator is not None:
+            self._propagator.undo_to(checkpoint)
+
+    def get_changes_since(self, checkpoint: int) -> Iterator[Tuple[int, Variable]]:
+        """Return the (checkpoint just before it, variable) of each current domain change since the checkpoint, oldest first"""
+        return self._trail.get_checkpointed_changes(checkpoint)
+
+    def get_snapshot(self) -> Dict[any, Tuple[any, Tuple[any, ...]]]:
+        """Return the value and current domain of every variable by name, in a form that can be sent to another process"""
+        return {variable.get_name(): (variable.get_value(), variable.get_curr_domain()) for variable in self._variables}
+
+    def restore_snapshot(self, snapshot: Dict[any, Tuple[any, Tuple[any, ...]]]) -> None:
+        """Restore the values and current domains from get_snapshot, which becomes the new base of the trail"""
+        self._trail.clear()
+        if self._propagator is not None:
+            self._propagator.reset()
+        for variable in self._variables:
+            value, curr_domain = snapshot[variable.get_name()]
+            variable.restore_curr_domain_mask(variable.get_encoding().get_mask(curr_domain))
+            if value is None:
+                variable.unassign()
+            else:
+                variable.set_value(value)
+
+    def propagate(self, changed_variable: Optional[Variable] = None) -> bool:
+        """
+        Propagate a change to changed_variable (or to every constraint, if None) until nothing changes, returning False
+        on a wipeout. Only the constraints of variables whose domains actually shrank are queued, each at most once, and
+        global constraints wait until the local ones are done.
+        """
+        if self._propagator is not None:
+            return self._propagator.propagate(self, changed_variable)
+        local_queue, global_queue = {}, {}  # constraint -> its changed variable, or None if several changed
+        if changed_variable is None:
+            for constraint in sorted(self._constraints, key=Constraint.get_name):
+                (global_queue if constraint.is_global() else local_queue)[constraint] = None
+        else:
+            self._enqueue_constraints(changed_variable, None, local_queue, global_queue)
+        if self._stats is not None or self._explaining:
+            return self._propagate_and_record(local_queue, global_queue, changed_variable is not None)
+
+        checkpoint = self._trail.checkpoint()
+        while len(local_queue) > 0 or len(global_queue) > 0:
+            queue = local_queue if len(local_queue) > 0 else global_queue
+            constraint = next(iter(queue))
+            if not constraint.propagate(queue.pop(constraint)):
+                return False
+            for variable in self._trail.get_changed_variables(checkpoint):
+                self._enqueue_constraints(variable, constraint, local_queue, global_queue)
+            checkpoint = self._trail.checkpoint()
+        return True
+
+    def _propagate_and_record(self, local_queue: Dict[Constraint, Optional[Variable]], global_queue: Dict[Constraint, Optional[Variable]], forward_checking: bool) -> bool:
+        # The loop of propagate, also recording statistics and explanations, whichever are on
+        stats = self._stats
+        forward_checking_constraints = set(local_queue) | set(global_queue) if stats is not None and forward_checking else set()
+        checkpoint = self._trail.checkpoint()
+        while len(local_queue) > 0 or len(global_queue) > 0:
+            queue = local_queue if len(local_queue) > 0 else global_queue
+            constraint = next(iter(queue))
+            start = time.perf_counter() if stats is not None else 0.0
+            consistent = constraint.propagate(queue.pop(constraint))
+            seconds = time.perf_counter() - start if stats is not None else 0.0
+
+            changed_variables = self._trail.get_changed_variables(checkpoint)
+            if stats is not None:
+                previous_masks = {}
+                for variable, mask in self._trail.get_changes(checkpoint):
+                    previous_masks.setdefault(variable, mask)
+                num_pruned = sum(mask.bit_count() - variable.get_curr_domain_mask().bit_count() for variable, mask in previous_masks.items())
+                stats.record_propagation(type(constraint).__name__, seconds, num_pruned, constraint in forward_checking_constraints, not consistent)
+            if self._explaining and (not consistent or len(changed_variables) > 0):
+                # What the constraint did can only depend on the domains of its variables
+                explanation = 0
+                for variable in constraint.get_target_variables():
+                    explanation |= variable.get_explanation()
+                if not consistent:
+                    self._conflict = explanation
+                for variable in changed_variables:
+                    variable.set_explanation(variable.get_explanation() | explanation)
+            if not consistent:
+                return False
+            for variable in changed_variables:
+                self._enqueue_constraints(variable, constraint, local_queue, global_queue)
+            checkpoint = self._trail.checkpoint()
+        return True
+
+    def _enqueue_constraints(self, variable: Variable, source: Optional[Constraint], local_queue: Dict[Constraint, Optional[Variable]], global_queue: Dict[Constraint, Optional[Variable]]) -> None:
+        # The constraint that made the change is already consistent with it
+        for constraint in self._constraints_of_each_variable[variable]:
+            if constraint is not source:
+                queue = global_queue if constraint.is_global() else local_queue
+                if constraint not in queue:
+                    queue[constraint] = variable
+                elif queue[constraint] is not variable:
+                    queue[constraint] = None
+
     def unassign_all_variables(self) -> None:
         for variable in self._variables:
             variable.unassign()
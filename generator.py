@@ -0,0 +1,106 @@
+import argparse
+import random
+from typing import *
+from puzzle import Puzzle, format_puzzle, ship_lengths
+
+
+difficulties = {'easy': 0.25, 'medium': 0.1, 'hard': 0.03}  # share of the cells given as hints
+
+
+#====================================================================================
+
+
+def create_fleet(N: int) -> Dict[str, int]:
+    """Return the usual fleet for boards up to 10x10, and the 10x10 fleet scaled to the board's area beyond that"""
+    if N <= 7:
+        counts = (3, 2, 1, 0) if N >= 6 else (2, 1, 1, 0)
+    else:
+        scale = max(1, (N / 10) ** 2)
+        counts = tuple(round(count * scale) for count in (4, 3, 2, 1))
+    return dict(zip(ship_lengths, counts))
+
+
+def generate_puzzle(N: int, difficulty: str = 'medium', seed: Optional[int] = None) -> Tuple[Puzzle, Dict[Tuple[int, int], any]]:
+    """
+    Lay a random fleet on an N x N board and derive the puzzle from it: the row and column tallies plus a share of
+    the cells, depending on the difficulty, as hints. Return the puzzle with the grid it was made from (the puzzle
+    may have other solutions too). The same arguments always give the same puzzle.
+    """
+    rng = random.Random(seed)
+    ship_constraints = create_fleet(N)
+    grid = None
+    while grid is None:
+        grid = _lay_fleet(N, ship_constraints, rng)
+
+    row_tallies = [sum(grid[(i, j)] != '.' for j in range(N)) for i in range(N)]
+    col_tallies = [sum(grid[(i, j)] != '.' for i in range(N)) for j in range(N)]
+    cells = sorted(grid)
+    hints = {cell: grid[cell] for cell in rng.sample(cells, round(difficulties[difficulty] * len(cells)))}
+    return Puzzle(row_tallies, col_tallies, ship_constraints, hints), grid
+
+
+def _lay_fleet(N: int, ship_constraints: Dict[str, int], rng: random.Random, max_tries: int = 100) -> Optional[Dict[Tuple[int, int], any]]:
+    # Place the ships largest first at random free spots, giving up (and starting over) if one does not fit
+    grid = {(i, j): '.' for i in range(N) for j in range(N)}
+    for ship_type in sorted(ship_constraints, key=lambda ship_type: -ship_lengths[ship_type]):
+        length = ship_lengths[ship_type]
+        for _ in range(ship_constraints[ship_type]):
+            for _ in range(max_tries):
+                di, dj = (0, 1) if rng.random() < 0.5 else (1, 0)
+                i, j = rng.randrange(N - di * (length - 1)), rng.randrange(N - dj * (length - 1))
+                cells = [(i + di * k, j + dj * k) for k in range(length)]
+                if all(grid.get((a + da, b + db), '.') == '.' for a, b in cells for da in (-1, 0, 1) for db in (-1, 0, 1)):
+                    break
+            else:
+                return None
+            if length == 1:
+                symbols = ['S']
+            else:
+                symbols = ['<' if dj else '^'] + ['M'] * (length - 2) + ['>' if dj else 'v']
+            for cell, symbol in zip(cells, symbols):
+                grid[cell] = symbol
+    return grid
+
+
+#====================================================================================
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate random puzzles, separated by blank lines.")
+    parser.add_argument(
+        "--outputfile",
+        type=str,
+        required=True,
+        help="The file to write the puzzles into."
+    )
+    parser.add_argument(
+        "--size",
+        type=int,
+        default=10,
+        help="Board size N."
+    )
+    parser.add_argument(
+        "--difficulty",
+        choices=list(difficulties),
+        default='medium',
+        help="How many cells are given as hints."
+    )
+    parser.add_argument(
+        "--count",
+        type=int,
+        default=1,
+        help="Number of puzzles to generate."
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the first puzzle; the others use the following seeds."
+    )
+    args = parser.parse_args()
+
+    output_file = open(args.outputfile, "w")
+    for k in range(args.count):
+        puzzle, _ = generate_puzzle(args.size, args.difficulty, args.seed + k)
+        output_file.write(('\n' if k > 0 else '') + ''.join(line + '\n' for line in format_puzzle(puzzle)))
+    output_file.close()
@@ -0,0 +1,212 @@
+import math
+import time
+from typing import *
+from csp import CSP, Variable
+from constraints import AtLeastOneConstraint, FleetConstraint, NValuesConstraint, SupportTable, TableConstraint
+
+try:
+    import numpy  # only needed by this backend
+except ImportError:
+    numpy = None
+
+
+class GridPropagator:
+    """
+    Propagation backend for the board CSP that mirrors the domains in an N x N uint8 array of bitmasks and applies
+    the local constraints to the whole grid at once with NumPy operations until nothing changes. Global constraints
+    (the fleet) still run on the constraint objects. It reaches the same domains as CSP.propagate but does not record
+    explanations.
+    """
+
+    def __init__(self, csp: CSP):
+        if numpy is None:
+            raise ImportError("the numpy propagation backend needs NumPy")
+        variables = csp.get_variables()
+        N = math.isqrt(len(variables))
+        cells = {variable.get_name(): variable for variable in variables}
+        self._N = N
+        self._variables = [cells[(i, j)] for i in range(N) for j in range(N)]
+        self._indices = {variable: k for k, variable in enumerate(self._variables)}
+        self._domains = None  # flat array of the masks as of the last call, None until the first
+        self._synced = 0  # CSP trail checkpoint up to which the array has taken in the changes
+        self._trail = []  # (CSP trail checkpoint, cell, previous mask) of each array change, flat as in Trail
+        encoding = self._variables[0].get_encoding()
+
+        # Neighbour pairs without a table constraint use lookup 0, which supports everything
+        lookups, lookup_ids = [numpy.full((2, 256), 255, numpy.uint8)], {}
+        self._horizontal = numpy.zeros((N, N - 1), numpy.intp)  # lookup of the pair (i, j), (i, j + 1)
+        self._vertical = numpy.zeros((N - 1, N), numpy.intp)  # lookup of the pair (i, j), (i + 1, j)
+        self._diagonal_right = numpy.zeros((N - 1, N - 1), numpy.uint8)  # value bit required in (i, j) or (i + 1, j + 1), or 0
+        self._diagonal_left = numpy.zeros((N - 1, N - 1), numpy.uint8)  # value bit required in (i, j + 1) or (i + 1, j)
+        # Lines without a tally constraint require nothing, which no count can violate
+        self._line_required = numpy.zeros((2, N, 1), numpy.uint8)  # rows then columns
+        self._lower_bounds = numpy.zeros((2, N), numpy.intp)
+        self._upper_bounds = numpy.full((2, N), N, numpy.intp)
+        self._global_constraints = []
+        for constraint in csp.get_constraints():
+            if constraint.is_global():
+                self._global_constraints.append(constraint)
+            elif isinstance(constraint, TableConstraint):
+                first, second = (variable.get_name() for variable in constraint.get_target_variables())
+                swapped = first > second
+                if swapped:
+                    first, second = second, first
+                key = (constraint.get_support_table(), swapped)
+                if key not in lookup_ids:
+                    lookup_ids[key] = len(lookups)
+                    lookups.append(create_lookup(*key))
+                offset = (second[0] - first[0], second[1] - first[1])
+                if offset == (0, 1) and self._horizontal[first] == 0:
+                    self._horizontal[first] = lookup_ids[key]
+                elif offset == (1, 0) and self._vertical[first] == 0:
+                    self._vertical[first] = lookup_ids[key]
+                else:
+                    raise ValueError("unsupported table constraint {}".format(constraint.get_name()))
+            elif isinstance(constraint, AtLeastOneConstraint) and constraint.get_num_target_variables() == 2:
+                first, second = sorted(variable.get_name() for variable in constraint.get_target_variables())
+                offset = (second[0] - first[0], second[1] - first[1])
+                if offset == (1, 1):
+                    self._diagonal_right[first] = encoding.get_bit(constraint.get_required_value())
+                elif offset == (1, -1):
+                    self._diagonal_left[first[0], second[1]] = encoding.get_bit(constraint.get_required_value())
+                else:
+                    raise ValueError("unsupported constraint {}".format(constraint.get_name()))
+            elif isinstance(constraint, NValuesConstraint) and constraint.get_num_target_variables() == N:
+                rows, cols = zip(*(variable.get_name() for variable in constraint.get_target_variables()))
+                if len(set(rows)) == 1:
+                    axis, line = 0, rows[0]
+                elif len(set(cols)) == 1:
+                    axis, line = 1, cols[0]
+                else:
+                    raise ValueError("unsupported constraint {}".format(constraint.get_name()))
+                self._line_required[axis, line] = encoding.get_mask(constraint.get_required_values())
+                self._lower_bounds[axis, line], self._upper_bounds[axis, line] = constraint.get_bounds()
+            else:
+                raise ValueError("unsupported constraint {}".format(constraint.get_name()))
+        # Flat lookups indexed by offset + neighbour mask, and the bits each diagonal pair may have to give up
+        self._lookups = numpy.stack(lookups).reshape(-1)
+        self._horizontal_offsets = (self._horizontal * 512, self._horizontal * 512 + 256)
+        self._vertical_offsets = (self._vertical * 512, self._vertical * 512 + 256)
+        self._diagonal_right_others = numpy.where(self._diagonal_right != 0, ~self._diagonal_right, 0).astype(numpy.uint8)
+        self._diagonal_left_others = numpy.where(self._diagonal_left != 0, ~self._diagonal_left, 0).astype(numpy.uint8)
+
+    def propagate(self, csp: CSP, changed_variable: Optional[Variable] = None) -> bool:
+        """Propagate the CSP's current domains until nothing changes, like CSP.propagate, returning False on a wipeout"""
+        stats = csp.get_stats()
+        start = time.perf_counter() if stats is not None else 0.0
+        num_pruned = 0
+        if self._domains is None:
+            self._domains = numpy.fromiter((variable.get_curr_domain_mask() for variable in self._variables), numpy.uint8, len(self._variables))
+            self._synced = csp.checkpoint()
+        if changed_variable is not None:
+            # Assignments are not on the CSP's trail, so the changed variable is copied in either way. An assignment
+            # also moves the trail on, or a search level that prunes nothing would share its checkpoint with the next
+            # and undoing the next level would take this copy with it.
+            self._set_mask(self._indices[changed_variable], changed_variable.get_curr_domain_mask(), csp.checkpoint())
+            if changed_variable.is_assigned():
+                changed_variable.mark_trail()
+        consistent = True
+        while consistent:
+            self._sync(csp)
+            masks = self._domains
+            domains = self.propagate_domains(masks.reshape(self._N, self._N))
+            if domains is None:
+                consistent = False
+                break
+            domains = domains.reshape(-1)
+            changed = numpy.flatnonzero(domains != masks)
+            if stats is not None:
+                num_pruned += int(numpy.unpackbits(masks[changed]).sum()) - int(numpy.unpackbits(domains[changed]).sum())
+
+            # Write the changes back in one go, all under the checkpoint they started from
+            checkpoint = csp.checkpoint()
+            cells, old_masks, new_masks = changed.tolist(), masks[changed].tolist(), domains[changed].tolist()
+            masks[changed] = domains[changed]
+            for k, old_mask, new_mask in zip(cells, old_masks, new_masks):
+                self._trail.extend((checkpoint, k, old_mask))
+                self._variables[k].set_curr_domain_mask(new_mask)
+            self._synced = csp.checkpoint()
+
+            # Start over only if a global constraint pruned something
+            checkpoint = csp.checkpoint()
+            consistent = all(constraint.can_be_satisfied(masks.tolist()) if isinstance(constraint, FleetConstraint) else constraint.propagate(None) for constraint in self._global_constraints)
+            if csp.checkpoint() == checkpoint:
+                break
+        if stats is not None:
+            stats.record_propagation(type(self).__name__, time.perf_counter() - start, num_pruned, changed_variable is not None, not consistent)
+        return consistent
+
+    def undo_to(self, checkpoint: int) -> None:
+        """Undo the array changes made since the CSP trail checkpoint, after the CSP has undone its own"""
+        entries = self._trail
+        while len(entries) > 0 and entries[-3] >= checkpoint:
+            mask = entries.pop()
+            k = entries.pop()
+            entries.pop()
+            self._domains[k] = mask
+        self._synced = min(self._synced, checkpoint)
+
+    def reset(self) -> None:
+        """Forget the array, to be read again from the variables on the next call"""
+        self._domains = None
+        self._trail.clear()
+
+    def _sync(self, csp: CSP) -> None:
+        # Copy in the cells changed on the CSP's trail since the last sync, each change kept with its trail position
+        for checkpoint, variable in csp.get_changes_since(self._synced):
+            self._set_mask(self._indices[variable], variable.get_curr_domain_mask(), checkpoint)
+        self._synced = csp.checkpoint()
+
+    def _set_mask(self, k: int, mask: int, checkpoint: int) -> None:
+        if self._domains[k] != mask:
+            self._trail.extend((checkpoint, k, int(self._domains[k])))
+            self._domains[k] = mask
+
+    def propagate_domains(self, domains: 'numpy.ndarray') -> Optional['numpy.ndarray']:
+        """Return a copy of the N x N domain masks with the local constraints applied until nothing changes, or None on a wipeout"""
+        domains = domains.copy()
+        while True:
+            previous = domains.copy()
+            self._revise_neighbours(domains)
+            self._revise_diagonals(domains)
+            if not self._revise_lines(domains) or not domains.all():
+                return None
+            if numpy.array_equal(domains, previous):
+                return domains
+
+    def _revise_neighbours(self, domains: 'numpy.ndarray') -> None:
+        # Each cell keeps the values supported by its right and lower neighbours, then the other way round
+        lookups = self._lookups
+        domains[:, :-1] &= lookups.take(self._horizontal_offsets[0] + domains[:, 1:])
+        domains[:, 1:] &= lookups.take(self._horizontal_offsets[1] + domains[:, :-1])
+        domains[:-1, :] &= lookups.take(self._vertical_offsets[0] + domains[1:, :])
+        domains[1:, :] &= lookups.take(self._vertical_offsets[1] + domains[:-1, :])
+
+    def _revise_diagonals(self, domains: 'numpy.ndarray') -> None:
+        # A cell that cannot take the required value forces it on its diagonal neighbour
+        for required, others, first, second in ((self._diagonal_right, self._diagonal_right_others, domains[:-1, :-1], domains[1:, 1:]),
+                                                (self._diagonal_left, self._diagonal_left_others, domains[:-1, 1:], domains[1:, :-1])):
+            second &= ~(((first & required) == 0) * others)
+            first &= ~(((second & required) == 0) * others)
+
+    def _revise_lines(self, domains: 'numpy.ndarray') -> bool:
+        # Tally bounds as in NValuesConstraint.propagate, for the rows and the columns at once
+        masks = numpy.stack((domains, domains.T))
+        required = self._line_required
+        may = (masks & required) != 0
+        must = may & ((masks & ~required) == 0)
+        must_counts, may_counts = must.sum(axis=2), may.sum(axis=2)
+        if (must_counts > self._upper_bounds).any() or (may_counts < self._lower_bounds).any():
+            return False
+        undecided = may & ~must
+        removed = (undecided & (must_counts == self._upper_bounds)[:, :, None]) * required
+        removed |= (undecided & (may_counts == self._lower_bounds)[:, :, None]) * ~required
+        domains &= ~removed[0]
+        domains &= ~removed[1].T
+        return True
+
+
+def create_lookup(support_table: SupportTable, swapped: bool) -> 'numpy.ndarray':
+    """Return, for each position of a table pair, the supported mask of that position for every mask of the other"""
+    positions = (1, 0) if swapped else (0, 1)
+    return numpy.array([[support_table.get_supported_mask(position, other_mask) for other_mask in range(256)] for position in positions], numpy.uint8)
@@ -1,171 +1,592 @@
 import argparse
-import math
+import functools
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+import weakref
 from csp import *
 from constraints import *
+from puzzle import *
+from placements import iter_placement_solutions
+from stats import SolverStats
+from budget import CancellationToken, SearchBudget, SearchLimitReached
+from cache import SolutionCache
 
 
 ship_parts = {'S', '<', '>', '^', 'v', 'M'}
+engines = ('cells', 'placements')
+searches = ('chronological', 'backjumping')  # how the cells engine backtracks
+value_orderings = ('domain', 'water-first', 'tally', 'lcv')  # which value the cells engine tries first, see order_values
+propagations = ('objects', 'numpy')  # how the cells engine propagates, see create_propagator
+restart_nodes = 100  # nodes per unit of the Luby restart schedule
+probe_limit = 20000  # probes allowed in the probing stage, see probe_domains
+# Help of the options shared by the command lines of the modules that solve many puzzles
+engine_help = "Search over cell symbols (the CSP) or over whole ship placements."
+timeout_help = "Seconds allowed per puzzle before it is reported as timed out."
+shared_cache_help = "SQLite file of solutions shared by the workers, answering repeated puzzles and their mirror images."
+
+
+class SearchOptions(NamedTuple):
+    """
+    How the cells engine searches: search is one of searches, value_ordering one of value_orderings, and restarts
+    turns on randomized restarts seeded with seed, which only look for the first solution. propagation is one of
+    propagations, and probing adds the probing stage (see probe_domains) before the search.
+    """
+    search: str = 'chronological'
+    value_ordering: str = 'domain'
+    restarts: bool = False
+    seed: int = 0
+    propagation: str = 'objects'
+    probing: bool = False
+
+
+class SolveResult(NamedTuple):
+    """
+    How a solve ended: status is 'solved', 'unsatisfiable', 'timeout', 'node_limit' or 'cancelled'. The solutions
+    found before a limit was reached are kept, and stats holds the SolverStats counters if statistics were collected.
+    """
+    status: str
+    solutions: List[Dict[Tuple[int, int], any]]
+    nodes: int
+    seconds: float
+    stats: Optional[Dict[str, any]] = None
+
+
+
+def count_available_cores() -> int:
+    """Return the number of cores this process may run on, the default number of worker processes"""
+    return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
 
 
 #====================================================================================
 
 
-def find_solutions(csp: CSP, initial_assignments: Dict[Variable, any]) -> List[Dict[Tuple[int, int], any]]:
-    # Preprocessing
+def solve_puzzle(puzzle: Puzzle, engine: str = 'cells', processes: int = 1, max_solutions: Optional[int] = 1, time_limit: Optional[float] = None, node_limit: Optional[int] = None, token: Optional[CancellationToken] = None, stats: Optional[SolverStats] = None, options: SearchOptions = SearchOptions(), cache: Optional[SolutionCache] = None) -> SolveResult:
+    """
+    Search for up to max_solutions solutions within the given limits, always returning a SolveResult. With a cache,
+    puzzles it already knows enough solutions of (or a mirror image or transpose of them) are answered without
+    searching, and the solutions found are added to it.
+    """
+    budget = SearchBudget(time_limit, node_limit, token)
+    solutions, status = [], None
+    start = time.perf_counter()
+    if cache is not None:
+        cached_solutions = cache.get(puzzle, max_solutions)
+        if cached_solutions is not None:
+            status = 'solved' if len(cached_solutions) > 0 else 'unsatisfiable'
+            return SolveResult(status, cached_solutions, 0, time.perf_counter() - start, None if stats is None else stats.to_dict())
+    try:
+        for solution in iter_puzzle_solutions(puzzle, engine, processes, max_solutions, stats, budget, options):
+            solutions.append(solution)
+    except SearchLimitReached as limit:
+        status = limit.reason
+    if status is None:
+        status = 'solved' if len(solutions) > 0 else 'unsatisfiable'
+    if cache is not None and (status in {'solved', 'unsatisfiable'} or len(solutions) > 0):
+        cache.put(puzzle, solutions, status in {'solved', 'unsatisfiable'} and (max_solutions is None or len(solutions) < max_solutions))
+    return SolveResult(status, solutions, budget.get_num_nodes(), time.perf_counter() - start, None if stats is None else stats.to_dict())
+
+
+def iter_puzzle_solutions(puzzle: Puzzle, engine: str = 'cells', processes: int = 1, max_solutions: Optional[int] = None, stats: Optional[SolverStats] = None, budget: Optional[SearchBudget] = None, options: SearchOptions = SearchOptions()) -> Iterator[Dict[Tuple[int, int], any]]:
+    """
+    Yield up to max_solutions solutions of the puzzle from the cell-level CSP search or from the ship placement
+    search. The cell-level search follows the search options, can split its search tree over several processes, and
+    fills in stats if given. Iterating raises SearchLimitReached once the budget, if any, runs out.
+    """
+    if engine == 'placements':
+        if stats is not None:
+            print("Warning: search statistics are only collected by the cells engine", file=sys.stderr)
+        return itertools.islice(iter_placement_solutions(puzzle, budget), max_solutions)
+    if options.propagation == 'numpy':
+        from gridprop import numpy  # imported here so that only the numpy backend pays for importing NumPy
+        if numpy is None:
+            print("Warning: NumPy is not installed, propagating with the constraint objects", file=sys.stderr)
+            options = options._replace(propagation='objects')
+    if options.propagation == 'numpy' and options.search == 'backjumping':
+        print("Warning: backjumping needs the explanations of the constraint objects, propagating with them", file=sys.stderr)
+        options = options._replace(propagation='objects')
+    if processes != 1:
+        from parallel import iter_parallel_solutions  # imported here as parallel builds on this module
+        return iter_parallel_solutions(puzzle, processes, max_solutions, stats, budget, options)
+    if options.restarts and max_solutions != 1:
+        print("Warning: restarts only look for the first solution, searching without them", file=sys.stderr)
+        options = options._replace(restarts=False)
+    csp, initial_assignments, _, _ = create_csp(puzzle)
+    csp.set_stats(stats)
+    csp.set_budget(budget)
+    return take_solutions(iter_solutions(csp, initial_assignments, options), max_solutions)
+
+
+def take_solutions(solutions: Generator[Dict[Tuple[int, int], any], None, None], max_solutions: Optional[int]) -> Iterator[Dict[Tuple[int, int], any]]:
+    """Like itertools.islice, but close the search as soon as max_solutions have been taken so that it finishes at once"""
+    try:
+        yield from itertools.islice(solutions, max_solutions)
+    finally:
+        solutions.close()
+
+
+def find_solutions(csp: CSP, initial_assignments: Dict[Variable, any], find_all: bool = False) -> List[Dict[Tuple[int, int], any]]:
+    return list(itertools.islice(iter_solutions(csp, initial_assignments), None if find_all else 1))
+
+
+def count_solutions(csp: CSP, initial_assignments: Dict[Variable, any], max_solutions: Optional[int] = None) -> int:
+    """Count the solutions without keeping them, stopping early once max_solutions have been found"""
+    return sum(1 for _ in itertools.islice(iter_solutions(csp, initial_assignments), max_solutions))
+
+
+def check_uniqueness(puzzle: Puzzle, engine: str = 'cells', processes: int = 1, time_limit: Optional[float] = None, node_limit: Optional[int] = None, token: Optional[CancellationToken] = None, options: SearchOptions = SearchOptions(), stats: Optional[SolverStats] = None) -> str:
+    """
+    Return 'unique', 'multiple' or 'unsatisfiable', searching only until a second solution turns up, or the reason the
+    search stopped early ('timeout', 'node_limit' or 'cancelled'). The search fills in stats if given.
+    """
+    result = solve_puzzle(puzzle, engine, processes, 2, time_limit, node_limit, token, stats, options)
+    if len(result.solutions) == 2:
+        return 'multiple'
+    if result.status != 'solved':
+        return result.status
+    return 'unique'
+
+
+def find_puzzle_backbone(puzzle: Puzzle, time_limit: Optional[float] = None, node_limit: Optional[int] = None, token: Optional[CancellationToken] = None, stats: Optional[SolverStats] = None) -> Optional[Dict[Tuple[int, int], any]]:
+    """Return the cells that have the same symbol in every solution, or None if there is no solution, filling in stats if given"""
+    csp, initial_assignments, _, _ = create_csp(puzzle)
+    csp.set_stats(stats)
+    csp.set_budget(SearchBudget(time_limit, node_limit, token))
+    if stats is not None:
+        stats.start()
+    try:
+        if not preprocess(csp, initial_assignments):
+            return None
+        return find_backbone(csp)
+    finally:
+        if stats is not None:
+            stats.stop()
+
+
+def find_backbone(csp: CSP) -> Optional[Dict[Tuple[int, int], any]]:
+    """
+    Return the variables that take the same value in every solution extending the current state, or None if there is
+    none, leaving the state as it was. Starting from one solution, each cell that still agrees with every solution
+    found so far is tested by searching for a solution without its value: if there is none the cell is in the
+    backbone and keeps its value for the tests that follow, otherwise the new solution rules out every cell it
+    differs in. Cells that propagation has already decided need no search.
+    """
+    solutions = backtracking_search(csp)
+    try:
+        solution = next(solutions, None)
+    finally:
+        solutions.close()
+    if solution is None:
+        return None
+    candidates = dict(solution)
+    backbone = {}
+    checkpoint = csp.checkpoint()
+    assigned = []
+    try:
+        for variable in sorted(csp.get_variables(), key=Variable.get_name):
+            name = variable.get_name()
+            if name not in candidates:
+                continue
+            value = candidates[name]
+            if variable.get_curr_domain_size() > 1:
+                other_solution = find_solution_without(csp, variable, value)
+                if other_solution is not None:
+                    candidates = {cell: candidates[cell] for cell in candidates if other_solution[cell] == candidates[cell]}
+                    continue
+                variable.set_value(value)
+                assigned.append(variable)
+                # The first solution takes the value and extends the state, so propagating it cannot fail
+                consistent = reduce_domains(csp, variable, value)
+                assert consistent
+            backbone[name] = value
+    finally:
+        for variable in assigned:
+            variable.unassign()
+        csp.undo_to(checkpoint)
+    return backbone
+
+
+def find_solution_without(csp: CSP, variable: Variable, value: any) -> Optional[Dict[Tuple[int, int], any]]:
+    """Return a solution in which the unassigned variable takes another value than value, or None"""
+    checkpoint = csp.checkpoint()
+    try:
+        variable.set_curr_domain_mask(variable.get_curr_domain_mask() & ~variable.get_encoding().get_bit(value))
+        if not csp.propagate(variable):
+            return None
+        solutions = backtracking_search(csp)
+        try:
+            return next(solutions, None)
+        finally:
+            solutions.close()
+    finally:
+        csp.undo_to(checkpoint)
+
+
+def iter_solutions(csp: CSP, initial_assignments: Dict[Variable, any], options: SearchOptions = SearchOptions()) -> Iterator[Dict[Tuple[int, int], any]]:
+    """Yield the solutions one at a time as the search finds them"""
+    stats = csp.get_stats()
+    if stats is not None:
+        stats.start()
+    try:
+        csp.set_explaining(options.search == 'backjumping')
+        csp.set_value_ordering(create_value_ordering(options.value_ordering))
+        csp.set_propagator(create_propagator(csp, options.propagation))
+        if preprocess(csp, initial_assignments) and (not options.probing or probe_domains(csp, probe_limit)):
+            if options.restarts:
+                yield from restarting_search(csp, options.search, options.value_ordering, options.seed)
+            elif options.search == 'backjumping':
+                yield from backjumping_search(csp, NogoodStore())
+            else:
+                yield from backtracking_search(csp)
+    finally:
+        csp.set_explaining(False)
+        csp.set_value_ordering(None)
+        csp.set_propagator(None)
+        if stats is not None:
+            stats.stop()
+
+
+def preprocess(csp: CSP, initial_assignments: Dict[Variable, any]) -> bool:
+    """
+    Propagate the initial assignments, then assign every variable whose domain is down to one value. Return False if
+    this already shows that the puzzle has no solution.
+    """
     for variable in initial_assignments:
-        assert reduce_domains(csp, variable, initial_assignments[variable])
+        if not reduce_domains(csp, variable, initial_assignments[variable]):
+            return False
+    if not csp.propagate():
+        return False
+    return assign_decided_variables(csp)
+
+
+def assign_decided_variables(csp: CSP) -> bool:
+    """Assign every variable whose domain is down to one value, returning False if propagating them fails"""
     new_assignments = {}
     for variable in csp.get_variables():
         if not variable.is_assigned() and variable.get_curr_domain_size() == 1:
-            variable.set_value(variable.get_curr_domain().pop())
+            variable.set_value(variable.get_curr_domain()[0])
             new_assignments.update({variable: variable.get_value()})
-    for constraint in csp.get_constraints():
-        if constraint.get_name().startswith('NValuesConstraint_'):
-            ship_parts_required = int(constraint.get_name()[-1])
-            curr_num_ship_parts = sum(1 for variable in constraint.get_target_variables() if variable.get_value() in ship_parts)
-            if ship_parts_required == curr_num_ship_parts:
-                for variable in constraint.get_target_variables():
-                    if not variable.is_assigned():
-                        variable.set_value('.')
-                        new_assignments.update({variable: '.'})
     for variable in new_assignments:
-        assert reduce_domains(csp, variable, new_assignments[variable])
-    return backtracking_search(csp)
+        if not reduce_domains(csp, variable, new_assignments[variable]):
+            return False
+    return True
+
 
+def probe_domains(csp: CSP, max_probes: Optional[int] = None) -> bool:
+    """
+    Failed-literal probing: for each unassigned variable, tentatively restrict it to water and then to ship parts and
+    propagate; a side that fails is removed for good. Rounds repeat until a round removes nothing or max_probes
+    probes have been made, then the variables left with one value are assigned. The budget's time limit and
+    cancellation are checked between probes. Return False if this shows that there is no solution.
+    """
+    budget = csp.get_budget()
+    num_probes, pruned = 0, True
+    while pruned:
+        pruned = False
+        for variable in sorted(csp.get_variables(), key=Variable.get_name):
+            encoding = variable.get_encoding()
+            water_mask = encoding.get_bit('.')
+            for probe_mask in (water_mask, encoding.get_full_mask() & ~water_mask):
+                mask = variable.get_curr_domain_mask()
+                if variable.is_assigned() or mask & probe_mask in {0, mask}:
+                    continue
+                if max_probes is not None and num_probes >= max_probes:
+                    return assign_decided_variables(csp)
+                if budget is not None:
+                    budget.check()
+                num_probes += 1
+                checkpoint = csp.checkpoint()
+                variable.set_curr_domain_mask(mask & probe_mask)
+                consistent = csp.propagate(variable)
+                csp.undo_to(checkpoint)
+                if not consistent:
+                    variable.set_curr_domain_mask(mask & ~probe_mask)
+                    if not csp.propagate(variable):
+                        return False
+                    pruned = True
+    return assign_decided_variables(csp)
+
+
+def backtracking_search(csp: CSP, depth: int = 0) -> Iterator[Dict[Tuple[int, int], any]]:
+    """Yield the solutions that extend from the current assignment, undoing the search state when closed early"""
+    stats = csp.get_stats()
+    budget = csp.get_budget()
 
-def backtracking_search(csp: CSP) -> List[Dict[Tuple[int, int], any]]:
-    """Return all solutions that can extend from the current assignment"""
     # Select a variable to assign or return the current assignment for base case
-    min_domain_size = math.inf
-    variable_to_assign = None
-    curr_assignment = {}
-    for variable in csp.get_variables():
-        if variable.is_assigned():
-            curr_assignment.update({variable.get_name(): variable.get_value()})
-        elif variable.get_curr_domain_size() < min_domain_size:
-            min_domain_size = variable.get_curr_domain_size()
-            variable_to_assign = variable
+    variable_to_assign = csp.select_unassigned_variable()
     if variable_to_assign is None:
-        return [curr_assignment]
+        if stats is not None:
+            stats.record_solution()
+        yield {variable.get_name(): variable.get_value() for variable in csp.get_variables()}
+        return
 
     # Try each value in the domain and see if it leads to some solutions
-    solutions = []
-    for value in variable_to_assign.get_curr_domain():
+    num_solutions = stats.get_num_solutions() if stats is not None else 0
+    for value in csp.order_values(variable_to_assign):
+        if budget is not None:
+            budget.charge_node()
+        checkpoint = csp.checkpoint()
         variable_to_assign.set_value(value)
-        if reduce_domains(csp, variable_to_assign, value):
-            solutions.extend(backtracking_search(csp))
-        variable_to_assign.unassign()
-        Variable.restore_values(variable_to_assign, value)
-
-    return solutions
+        if stats is not None:
+            stats.record_node(depth + 1)
+        try:
+            if reduce_domains(csp, variable_to_assign, value):
+                yield from backtracking_search(csp, depth + 1)
+            elif stats is not None:
+                stats.record_failure()
+        finally:
+            variable_to_assign.unassign()
+            csp.undo_to(checkpoint)
+    if stats is not None and stats.get_num_solutions() == num_solutions:
+        stats.record_backtrack()
+
+
+def backjumping_search(csp: CSP, nogoods: Optional[NogoodStore] = None, decisions: Optional[List[Tuple[Variable, any]]] = None) -> Generator[Dict[Tuple[int, int], any], None, Optional[int]]:
+    """
+    Conflict-directed backjumping: yield the same solutions as backtracking_search, but when a value fails for
+    reasons that do not involve the variable just assigned, jump straight back to the latest decision that is
+    involved instead of trying its remaining values. The CSP must be explaining (see CSP.set_explaining). Each
+    failure is learned as a nogood if a store is given, and values that would complete a stored nogood are skipped.
+
+    The generator returns the decision levels, as a bitmask, that the failure of this subtree depends on, or None if
+    the subtree had solutions.
+    """
+    stats = csp.get_stats()
+    budget = csp.get_budget()
+    if decisions is None:
+        decisions = []
 
-
-def reduce_domains(csp: CSP, reason_variable: Variable, reason_value: any) -> bool:
-    # Forward checking
-    constraints_involved = csp.get_constraints_of_variable(reason_variable)
-    for constraint in constraints_involved:
-        if constraint.get_name().startswith('NValuesConstraint_') and reason_value in ship_parts:
-            ship_parts_required = int(constraint.get_name()[-1])
-            curr_num_ship_parts = sum(
-                1 for variable in constraint.get_target_variables() if variable.get_value() in ship_parts)
-            if curr_num_ship_parts == ship_parts_required:
-                for variable in constraint.get_target_variables():
-                    if not variable.is_assigned():
-                        if variable.value_in_curr_domain('.'):
-                            values_to_remove = []
-                            for value in variable.get_curr_domain():
-                                if value != '.':
-                                    values_to_remove.append(value)
-                            for value in values_to_remove:
-                                variable.remove_value_from_curr_domain(value, reason_variable, reason_value)
-                        else:
-                            return False
+    # Select a variable to assign or return the current assignment for base case
+    variable_to_assign = csp.select_unassigned_variable()
+    if variable_to_assign is None:
+        if stats is not None:
+            stats.record_solution()
+        yield {variable.get_name(): variable.get_value() for variable in csp.get_variables()}
+        return None
+
+    # The values missing from the domain were pruned because of the decisions in its explanation
+    level_bit = 1 << (len(decisions) + 1)
+    domain_explanation = variable_to_assign.get_explanation()
+    conflict, has_solutions = domain_explanation, False
+    for value in csp.order_values(variable_to_assign):
+        if budget is not None:
+            budget.charge_node()
+        nogood = nogoods.find_violated(variable_to_assign, value) if nogoods is not None else None
+        if nogood is not None:
+            value_conflict = level_bit
+            for level, decision in enumerate(decisions):
+                if decision in nogood:
+                    value_conflict |= 1 << (level + 1)
+        else:
+            checkpoint = csp.checkpoint()
+            variable_to_assign.set_value(value)
+            variable_to_assign.set_explanation(level_bit)
+            decisions.append((variable_to_assign, value))
+            if stats is not None:
+                stats.record_node(len(decisions))
+            try:
+                if reduce_domains(csp, variable_to_assign, value):
+                    value_conflict = yield from backjumping_search(csp, nogoods, decisions)
+                else:
+                    value_conflict = csp.get_conflict()
+                    if stats is not None:
+                        stats.record_failure()
+            finally:
+                decisions.pop()
+                variable_to_assign.unassign()
+                csp.undo_to(checkpoint)
+                variable_to_assign.set_explanation(domain_explanation)
+
+        if value_conflict is None:
+            has_solutions = True
+            continue
+        if not value_conflict & level_bit and not has_solutions:
+            return value_conflict  # the decision at this level is not to blame
+        if nogoods is not None and nogood is None:
+            nogoods.add(frozenset(decision for level, decision in enumerate(decisions) if value_conflict & 1 << (level + 1)) | {(variable_to_assign, value)}, (variable_to_assign, value))
+        conflict |= value_conflict & ~level_bit
+
+    if has_solutions:
+        return None
+    if stats is not None:
+        stats.record_backtrack()
+    return conflict
+
+
+def restarting_search(csp: CSP, search: str = 'chronological', value_ordering: str = 'domain', seed: int = 0) -> Iterator[Dict[Tuple[int, int], any]]:
+    """
+    Search for the first solution in runs of luby(1), luby(2), ... times restart_nodes nodes, abandoning a run that
+    does not finish within its nodes for the next one. Every run after the first breaks variable and value ties at
+    random, from a generator seeded with seed so that the same seed always takes the same path. The CSP's budget
+    still applies to the runs together.
+    """
+    budget = csp.get_budget()
+    rng = random.Random(seed)
+    try:
+        for run in itertools.count(1):
+            csp.set_value_ordering(create_value_ordering(value_ordering, rng if run > 1 else None))
+            csp.set_tie_breaking(rng if run > 1 else None)
+            node_limit = luby(run) * restart_nodes
+            if budget is not None and budget.get_node_limit() is not None:
+                node_limit = min(node_limit, budget.get_node_limit() - budget.get_num_nodes())
+            run_budget = SearchBudget(node_limit=node_limit, token=None if budget is None else budget.get_token(), deadline=None if budget is None else budget.get_deadline())
+            csp.set_budget(run_budget)
+            try:
+                solutions = backjumping_search(csp, NogoodStore()) if search == 'backjumping' else backtracking_search(csp)
+                solution = next(solutions, None)
+                solutions.close()
+            except SearchLimitReached as limit:
+                if limit.reason != 'node_limit':
+                    raise
+                if budget is not None:
+                    budget.add_nodes(run_budget.get_num_nodes())
+                    budget.check()
                 continue
-        for variable in constraint.get_target_variables():
-            if not variable.is_assigned():
-                values_to_remove = []
-                for value in variable.get_curr_domain():
-                    if not constraint.has_support(variable, value):
-                        values_to_remove.append(value)
-                        if len(values_to_remove) == variable.get_curr_domain_size():
-                            return False
-                for value in values_to_remove:
-                    variable.remove_value_from_curr_domain(value, reason_variable, reason_value)
-
-    # AC3
-    ac3_constraints = set()
-    for constraint in csp.get_constraints():
-        if constraint.get_num_target_variables() == constraint.get_num_unassigned_variables() == 2:
-            for variable in constraint.get_target_variables():
-                ac3_constraints.add((variable, constraint))
-    while len(ac3_constraints) > 0:
-        variable, constraint = ac3_constraints.pop()
-        values_to_remove = []
-        for value in variable.get_curr_domain():
-            if not constraint.has_support(variable, value):
-                values_to_remove.append(value)
-                if len(values_to_remove) == variable.get_curr_domain_size():
-                    return False
-        for value in values_to_remove:
-            variable.remove_value_from_curr_domain(value, reason_variable, reason_value)
-        if len(values_to_remove) > 0:
-            for related_constraint in csp.get_constraints_of_variable(variable):
-                if related_constraint.get_num_target_variables() == related_constraint.get_num_unassigned_variables() == 2:
-                    for related_variable in related_constraint.get_target_variables():
-                        if related_variable not in constraint.get_target_variables():
-                            ac3_constraints.add((related_variable, related_constraint))
-
-    return True
+            finally:
+                csp.set_budget(budget)
+            if budget is not None:
+                budget.add_nodes(run_budget.get_num_nodes())
+            if solution is not None:
+                yield solution
+            return
+    finally:
+        csp.set_value_ordering(create_value_ordering(value_ordering))
+        csp.set_tie_breaking(None)
+
+
+def create_propagator(csp: CSP, propagation: str) -> Optional['GridPropagator']:
+    """
+    Return the propagation backend for one of propagations: None for the constraint objects (the reference), or a
+    GridPropagator that propagates the whole grid with NumPy. Every call pays a fixed cost per NumPy operation, so a
+    search node costs less than with the constraint objects only from about 20 x 20 up.
+    """
+    if propagation == 'numpy':
+        from gridprop import GridPropagator  # imported here so that only the numpy backend pays for importing NumPy
+        return GridPropagator(csp)
+    return None
+
+
+def luby(i: int) -> int:
+    """Return the i-th term, counting from 1, of the Luby sequence 1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8, ..."""
+    while True:
+        k = i.bit_length()
+        if i == (1 << k) - 1:
+            return 1 << (k - 1)
+        i -= (1 << (k - 1)) - 1
+
+
+def create_value_ordering(value_ordering: str, rng: Optional[random.Random] = None) -> Optional[Callable[[CSP, Variable], Sequence[any]]]:
+    """Return the CSP value ordering for one of value_orderings, or None if the domain's order will do"""
+    if value_ordering == 'domain' and rng is None:
+        return None
+    return functools.partial(order_values, value_ordering=value_ordering, rng=rng)
+
+
+def order_values(csp: CSP, variable: Variable, value_ordering: str, rng: Optional[random.Random] = None) -> List[any]:
+    """
+    Order the variable's current domain:
+    - domain: the domain's own order
+    - water-first: water before ship parts
+    - tally: water first if the variable's row or column needs ship parts in at most half of its undecided cells,
+      ship parts first otherwise
+    - lcv: least constraining value first, the one that leaves the most values to the neighbouring cells
+    Ties keep the domain's order, or are broken at random if rng is given.
+    """
+    values = variable.get_curr_domain()
+    if value_ordering == 'water-first':
+        keys = {value: value != '.' for value in values}
+    elif value_ordering == 'tally':
+        water_first = get_ship_share(csp, variable) <= 0.5
+        keys = {value: (value != '.') == water_first for value in values}
+    elif value_ordering == 'lcv':
+        constraints = [constraint for constraint in csp.get_constraints_of_variable(variable) if isinstance(constraint, TableConstraint)]
+        keys = {value: -sum(constraint.count_supports(variable, value) for constraint in constraints) for value in values}
+    else:
+        keys = {value: 0 for value in values}
+    if rng is not None:
+        return sorted(values, key=lambda value: (keys[value], rng.random()))
+    return sorted(values, key=keys.get)
+
+
+def get_ship_share(csp: CSP, variable: Variable) -> float:
+    """Return the largest share of undecided cells that must still become ship parts in the variable's row and column"""
+    ship_share = 0.0
+    for constraint in csp.get_constraints_of_variable(variable):
+        if isinstance(constraint, NValuesConstraint):
+            must_count, may_count = constraint.count_required_values()
+            if may_count > must_count:
+                ship_share = max(ship_share, (constraint.get_bounds()[1] - must_count) / (may_count - must_count))
+    return ship_share
 
 
-def find_solution_that_satisfies_ship_constraints(solutions: List[Dict[Tuple[int, int], any]], ship_constraints: Dict[str, int]) -> Dict[Tuple[int, int], any]:
-    # check for mistaken M and change them to S or ship heads
-    for solution in solutions:
-        curr_ships = {'submarines': 0, 'destroyers': 0, 'cruisers': 0, 'battleships': 0}
-        for i, j in solution:
-            if solution[(i, j)] == 'S':
-                curr_ships['submarines'] += 1
-            elif solution[(i, j)] in {'^', '<'}:
-                ship_type = identify_ship(solution, (i, j))
-                if ship_type in curr_ships:
-                    curr_ships[ship_type] += 1
-                else:
-                    break
-        if curr_ships == ship_constraints:
-            return solution
-
-
-def identify_ship(solution: Dict[Tuple[int, int], any], ship_start: Tuple[int, int]) -> str:
-    i, j = ship_start
-    if solution[(i, j)] == '^':
-        if (i + 1, j) in solution and solution[(i + 1, j)] == 'v':
-            return 'destroyers'
-        if (i + 1, j) in solution and solution[(i + 1, j)] == 'M' and (i + 2, j) in solution and solution[(i + 2, j)] == 'v':
-            return 'cruisers'
-        if (i + 1, j) in solution and solution[(i + 1, j)] == 'M' and (i + 2, j) in solution and solution[(i + 2, j)] == 'M' and (i + 3, j) in solution and solution[(i + 3, j)] == 'v':
-            return 'battleships'
-    if solution[(i, j)] == '<':
-        if (i, j + 1) in solution and solution[(i, j + 1)] == '>':
-            return 'destroyers'
-        if (i, j + 1) in solution and solution[(i, j + 1)] == 'M' and (i, j + 2) in solution and solution[(i, j + 2)] == '>':
-            return 'cruisers'
-        if (i, j + 1) in solution and solution[(i, j + 1)] == 'M' and (i, j + 2) in solution and solution[(i, j + 2)] == 'M' and (i, j + 3) in solution and solution[(i, j + 3)] == '>':
-            return 'battleships'
-    return ''
+def reduce_domains(csp: CSP, reason_variable: Variable, reason_value: any) -> bool:
+    # Forward checking and AC3 in one pass, queueing only the constraints around domains that shrank
+    return csp.propagate(reason_variable)
 
 
 #====================================================================================
 
 
 def read_from_file(filename: str) -> Tuple[CSP, Dict[Variable, any], Dict[str, int], int]:
-    f = open(filename)
-    lines = f.readlines()
-    N = len(lines[0]) - 1
-    variables, row_list, col_list = create_variables(N)
-    constraints, initial_assignments = create_constraints(lines[0].rstrip(), lines[1].rstrip(), row_list, col_list)
-    initial_assignments.update(assign_initial_variables(row_list, lines))
-    ship_constraints = {'submarines': int(lines[2][0]), 'destroyers': int(lines[2][1]), 'cruisers': int(lines[2][2]), 'battleships': int(lines[2][3])}
-    return CSP('battle', variables, constraints), initial_assignments, ship_constraints, N
+    return create_csp(read_puzzle_from_file(filename))
+
+
+def create_csp(puzzle: Puzzle, use_template: bool = True) -> Tuple[CSP, Dict[Variable, any], Dict[str, int], int]:
+    """Build the puzzle's CSP, on the cached template for its board size unless a CSP built on it is still alive"""
+    if use_template:
+        created = get_board_template(puzzle.get_size()).try_create_csp(puzzle)
+        if created is not None:
+            return created
+    return BoardTemplate(puzzle.get_size()).create_csp(puzzle)
+
+
+@functools.lru_cache(maxsize=16)
+def get_board_template(N: int) -> 'BoardTemplate':
+    return BoardTemplate(N)
+
+
+class BoardTemplate:
+    """
+    The part of the CSP that only depends on the board size: the variables, the neighbour and diagonal constraints
+    with their constraint index, and the ship patterns. Puzzles of that size attach their own line tallies, hints
+    and fleet to it, one CSP at a time; try_create_csp claims the template atomically, so threads may share it.
+    """
+
+    def __init__(self, N: int):
+        self._N = N
+        variables, self._row_list, self._col_list = create_variables(N)
+        self._csp = CSP('board_' + str(N), variables, create_neighbour_constraints(self._row_list, self._col_list))
+        self._ship_patterns = {}  # longest ship length -> ShipPatterns, computed on first use
+        self._user = None  # weak reference to the last CSP created from this template
+        self._lock = threading.Lock()  # held while claiming the template
+
+    def is_in_use(self) -> bool:
+        return self._user is not None and self._user() is not None
+
+    def try_create_csp(self, puzzle: Puzzle) -> Optional[Tuple[CSP, Dict[Variable, any], Dict[str, int], int]]:
+        """Create the puzzle's CSP on this template, or return None if a CSP created from it is still alive"""
+        with self._lock:
+            if self.is_in_use():
+                return None
+            return self.create_csp(puzzle)
+
+    def create_csp(self, puzzle: Puzzle) -> Tuple[CSP, Dict[Variable, any], Dict[str, int], int]:
+        assert puzzle.get_size() == self._N
+        for variable in self._csp.get_variables():
+            variable.reset()
+        constraints, initial_assignments = create_line_constraints(puzzle.row_tallies, puzzle.col_tallies, self._row_list, self._col_list)
+        initial_assignments.update(assign_initial_variables(self._row_list, puzzle.hints))
+        required_ships = puzzle.get_required_ships()
+        max_length = max(required_ships)
+        if max_length not in self._ship_patterns:
+            self._ship_patterns[max_length] = find_ship_patterns(self._row_list, max_length)
+        constraints.add(FleetConstraint('fleet', self._row_list, required_ships, self._ship_patterns[max_length]))
+        csp = self._csp.extend('battle', constraints)
+        self._user = weakref.ref(csp)
+        return csp, initial_assignments, puzzle.ship_constraints, self._N
 
 
 def create_variables(N: int) -> Tuple[Set[Variable], List[List[Variable]], List[List[Variable]]]:
@@ -183,14 +604,14 @@ def create_variables(N: int) -> Tuple[Set[Variable], List[List[Variable]], List[
     return variables, row_list, col_list
 
 
-def create_constraints(row_constraints: str, col_constraints: str, row_list: List[List[Variable]], col_list: List[List[Variable]]) -> Tuple[Set[Constraint], Dict[Variable, any]]:
+def create_line_constraints(row_constraints: List[int], col_constraints: List[int], row_list: List[List[Variable]], col_list: List[List[Variable]]) -> Tuple[Set[Constraint], Dict[Variable, any]]:
     constraints = set()
 
     # Create row and col constraints and make 0 rows/columns all water
     initial_assignments = {}
     for i in range(len(row_list)):
-        name = 'row_' + str(i) + '_' + row_constraints[i]
-        bound = int(row_constraints[i])
+        name = 'row_' + str(i)
+        bound = row_constraints[i]
         if bound == 0:
             for variable in row_list[i]:
                 variable.set_value('.')
@@ -198,30 +619,35 @@ def create_constraints(row_constraints: str, col_constraints: str, row_list: Lis
         else:
             constraints.add(NValuesConstraint(name, set(row_list[i]), ship_parts, bound, bound))
     for j in range(len(col_list)):
-        name = 'col_' + str(j) + '_' + col_constraints[j]
-        bound = int(col_constraints[j])
+        name = 'col_' + str(j)
+        bound = col_constraints[j]
         if bound == 0:
             for variable in col_list[j]:
                 variable.set_value('.')
                 initial_assignments.update({variable: '.'})
         else:
             constraints.add(NValuesConstraint(name, set(col_list[j]), ship_parts, bound, bound))
+    return constraints, initial_assignments
+
+
+def create_neighbour_constraints(row_list: List[List[Variable]], col_list: List[List[Variable]]) -> Set[Constraint]:
+    constraints = set()
 
     # Create horizontal and vertical neighbour constraints
     for i in range(len(row_list)):
         for j in range(len(col_list) - 1):
             variable_1, variable_2 = row_list[i][j], row_list[i][j + 1]
             name = 'horizontal_' + str(variable_1.get_name())
-            target_variables = {variable_1, variable_2}
-            satisfying_assignments = get_horizontal_neighbour_satisfying_assignments(variable_1, variable_2, len(col_list))
-            constraints.add(TableConstraint(name, target_variables, satisfying_assignments))
+            target_variables = (variable_1, variable_2)
+            satisfying_tuples = get_horizontal_neighbour_satisfying_tuples(i, j, len(col_list))
+            constraints.add(TableConstraint(name, target_variables, satisfying_tuples))
     for j in range(len(col_list)):
         for i in range(len(row_list) - 1):
             variable_1, variable_2 = col_list[j][i], col_list[j][i + 1]
             name = 'vertical_' + str(variable_1.get_name())
-            target_variables = {variable_1, variable_2}
-            satisfying_assignments = get_vertical_neighbour_satisfying_assignments(variable_1, variable_2, len(row_list))
-            constraints.add(TableConstraint(name, target_variables, satisfying_assignments))
+            target_variables = (variable_1, variable_2)
+            satisfying_tuples = get_vertical_neighbour_satisfying_tuples(i, j, len(row_list))
+            constraints.add(TableConstraint(name, target_variables, satisfying_tuples))
 
     # Create diagonal neighbour constraints
     for i in range(len(row_list) - 1):
@@ -238,65 +664,80 @@ def create_constraints(row_constraints: str, col_constraints: str, row_list: Lis
                 target_variables = {variable_1, variable_2}
                 constraints.add(AtLeastOneConstraint(name, target_variables, '.'))
 
-    return constraints, initial_assignments
+    return constraints
 
 
-def get_horizontal_neighbour_satisfying_assignments(variable_1: Variable, variable_2: Variable, N: int) -> List[Dict[Variable, any]]:
-    satisfying_assignments = [{variable_1: '.', variable_2: '.'}, {variable_1: '.', variable_2: 'S'}, {variable_1: 'S', variable_2: '.'}, {variable_1: '<', variable_2: '>'}]
-    i, j = variable_1.get_name()
+def get_horizontal_neighbour_satisfying_tuples(i: int, j: int, N: int) -> List[Tuple[any, any]]:
+    satisfying_tuples = [('.', '.'), ('.', 'S'), ('S', '.'), ('<', '>')]
     if i > 0:
-        satisfying_assignments.extend([{variable_1: 'v', variable_2: '.'}, {variable_1: '.', variable_2: 'v'}])
+        satisfying_tuples.extend([('v', '.'), ('.', 'v')])
     if i < N - 1:
-        satisfying_assignments.extend([{variable_1: '^', variable_2: '.'}, {variable_1: '.', variable_2: '^'}])
+        satisfying_tuples.extend([('^', '.'), ('.', '^')])
     if 0 < i < N - 1:
-        satisfying_assignments.extend([{variable_1: '.', variable_2: 'M'},  {variable_1: 'M', variable_2: '.'}])
+        satisfying_tuples.extend([('.', 'M'),  ('M', '.')])
     if j > 0:
-        satisfying_assignments.extend([{variable_1: 'M', variable_2: '>'}, {variable_1: '>', variable_2: '.'}])
+        satisfying_tuples.extend([('M', '>'), ('>', '.')])
     if j < N - 2:
-        satisfying_assignments.extend([{variable_1: '<', variable_2: 'M'}, {variable_1: '.', variable_2: '<'}])
+        satisfying_tuples.extend([('<', 'M'), ('.', '<')])
     if 0 < j < N - 2:
-        satisfying_assignments.extend([{variable_1: 'M', variable_2: 'M'}])
-    return satisfying_assignments
+        satisfying_tuples.extend([('M', 'M')])
+    return satisfying_tuples
 
 
-def get_vertical_neighbour_satisfying_assignments(variable_1: Variable, variable_2: Variable, N: int) -> List[Dict[Variable, any]]:
-    satisfying_assignments = [{variable_1: '.', variable_2: '.'}, {variable_1: '.', variable_2: 'S'}, {variable_1: 'S', variable_2: '.'}, {variable_1: '^', variable_2: 'v'}]
-    i, j = variable_1.get_name()
+def get_vertical_neighbour_satisfying_tuples(i: int, j: int, N: int) -> List[Tuple[any, any]]:
+    satisfying_tuples = [('.', '.'), ('.', 'S'), ('S', '.'), ('^', 'v')]
     if i > 0:
-        satisfying_assignments.extend([{variable_1: 'M', variable_2: 'v'}, {variable_1: 'v', variable_2: '.'}])
+        satisfying_tuples.extend([('M', 'v'), ('v', '.')])
     if i < N - 2:
-        satisfying_assignments.extend([{variable_1: '^', variable_2: 'M'}, {variable_1: '.', variable_2: '^'}])
+        satisfying_tuples.extend([('^', 'M'), ('.', '^')])
     if 0 < i < N - 2:
-        satisfying_assignments.extend([{variable_1: 'M', variable_2: 'M'}])
+        satisfying_tuples.extend([('M', 'M')])
     if j > 0:
-        satisfying_assignments.extend([{variable_1: '>', variable_2: '.'}, {variable_1: '.', variable_2: '>'}])
+        satisfying_tuples.extend([('>', '.'), ('.', '>')])
     if j < N - 1:
-        satisfying_assignments.extend([{variable_1: '<', variable_2: '.'}, {variable_1: '.', variable_2: '<'}])
+        satisfying_tuples.extend([('<', '.'), ('.', '<')])
     if 0 < j < N - 1:
-        satisfying_assignments.extend([{variable_1: '.', variable_2: 'M'},  {variable_1: 'M', variable_2: '.'}])
-    return satisfying_assignments
+        satisfying_tuples.extend([('.', 'M'),  ('M', '.')])
+    return satisfying_tuples
 
 
-def assign_initial_variables(row_list: List[List[Variable]], lines: List[str]) -> Dict[Variable, any]:
+def assign_initial_variables(row_list: List[List[Variable]], hints: Dict[Tuple[int, int], any]) -> Dict[Variable, any]:
     initial_assignments = {}
-    for i in range(len(row_list)):
-        for j in range(len(row_list[i])):
-            variable = row_list[i][j]
-            input_value = lines[3 + i][j]
-            if input_value != '0':
-                variable.set_value(input_value)
-                initial_assignments.update({variable: input_value})
+    for (i, j), input_value in hints.items():
+        variable = row_list[i][j]
+        variable.set_value(input_value)
+        initial_assignments.update({variable: input_value})
     return initial_assignments
 
 
-def write_to_file(filename: str, solution: Dict[Tuple[int, int], any], N: int):
+def write_to_file(filename: str, solution: Optional[Dict[Tuple[int, int], any]], N: int):
+    if solution is None:
+        print("Warning: there is no solution to write to {}".format(filename), file=sys.stderr)
+    write_solutions_to_file(filename, [] if solution is None else [solution], N)
+
+
+def write_solutions_to_file(filename: str, solutions: Iterable[Dict[Tuple[int, int], any]], N: int) -> int:
+    """Write each solution as soon as it is produced, separated by blank lines, and return how many were written"""
+    num_solutions = 0
     output_file = open(filename, "w")
+    try:
+        for solution in solutions:
+            if num_solutions > 0:
+                output_file.write('\n')
+            for line in format_solution(solution, N):
+                output_file.write(line + '\n')
+            output_file.flush()
+            num_solutions += 1
+    finally:
+        output_file.close()
+    return num_solutions
+
+
+def format_solution(solution: Dict[Tuple[int, int], any], N: int) -> List[str]:
     grid = [['0' for _ in range(N)] for _ in range(N)]
     for i, j in solution:
         grid[i][j] = solution[(i, j)]
-    for line in grid:
-        output_file.write(''.join(line) + '\n')
-    output_file.close()
+    return [''.join(line) for line in grid]
 
 
 #====================================================================================
@@ -313,11 +754,148 @@ if __name__ == '__main__':
     parser.add_argument(
         "--outputfile",
         type=str,
-        required=True,
-        help="The output file that contains the solution."
+        help="The output file that contains the solution(s). Required unless --count-only is given."
+    )
+    parser.add_argument(
+        "--max-solutions",
+        type=int,
+        default=None,
+        help="Stop after this many solutions (default: 1, or unlimited with --count-only)."
+    )
+    parser.add_argument(
+        "--count-only",
+        action="store_true",
+        help="Print the number of solutions instead of writing them."
+    )
+    parser.add_argument(
+        "--check-unique",
+        action="store_true",
+        help="Print whether the puzzle has a unique solution, searching only until a second one turns up."
+    )
+    parser.add_argument(
+        "--backbone",
+        action="store_true",
+        help="Write the cells that are the same in every solution, with 0 for the others (cells engine only)."
+    )
+    parser.add_argument(
+        "--engine",
+        choices=engines,
+        default='cells',
+        help=engine_help
+    )
+    parser.add_argument(
+        "--search",
+        choices=searches,
+        default='chronological',
+        help="How the cells engine backtracks: to the previous decision, or back to the latest decision a failure depends on, learning nogoods."
+    )
+    parser.add_argument(
+        "--value-ordering",
+        choices=value_orderings,
+        default='domain',
+        help="Which value the cells engine tries first for a cell."
+    )
+    parser.add_argument(
+        "--propagation",
+        choices=propagations,
+        default='objects',
+        help="Propagate with the constraint objects, or on the whole grid at once with NumPy (faster from about 20x20 up, slower on smaller boards)."
+    )
+    parser.add_argument(
+        "--probing",
+        action="store_true",
+        help="Before searching, remove water or ship parts from the cells where trying them fails straight away."
+    )
+    parser.add_argument(
+        "--restarts",
+        action="store_true",
+        help="Restart the cells engine on a Luby schedule with randomized value ties (first solution only)."
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the randomized restarts."
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Split the cell-level search over this many worker processes (0 for one per available core)."
+    )
+    parser.add_argument(
+        "--stats",
+        type=str,
+        nargs='?',
+        const='-',
+        default=None,
+        help="Write search statistics as JSON to this file, or print them if no file is given."
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default=None,
+        help="SQLite file of solutions from earlier runs to answer from (also mirror images and transposes), and to add to."
+    )
+    parser.add_argument(
+        "--time-limit",
+        type=float,
+        default=None,
+        help="Stop searching after this many seconds, keeping the solutions found so far."
+    )
+    parser.add_argument(
+        "--node-limit",
+        type=int,
+        default=None,
+        help="Stop searching after trying this many assignments (or ship placements)."
     )
     args = parser.parse_args()
-    csp, initial_assignments, ship_constraints, N = read_from_file(args.inputfile)
-    solutions = find_solutions(csp, initial_assignments)
-    solution = find_solution_that_satisfies_ship_constraints(solutions, ship_constraints)
-    write_to_file(args.outputfile, solution, N)
+    if not (args.count_only or args.check_unique) and args.outputfile is None:
+        parser.error("--outputfile is required unless --count-only or --check-unique is given")
+    puzzle = read_puzzle_from_file(args.inputfile)
+    processes = None if args.processes == 0 else args.processes
+    stats = SolverStats() if args.stats is not None else None
+    budget = SearchBudget(args.time_limit, args.node_limit)
+    options = SearchOptions(args.search, args.value_ordering, args.restarts, args.seed, args.propagation, args.probing)
+    num_solutions = 0
+    try:
+        if args.check_unique:
+            print(check_uniqueness(puzzle, args.engine, processes, args.time_limit, args.node_limit, options=options, stats=stats))
+        elif args.backbone:
+            backbone = find_puzzle_backbone(puzzle, args.time_limit, args.node_limit, stats=stats)
+            if backbone is None:
+                print("The puzzle has no solution")
+            else:
+                write_to_file(args.outputfile, backbone, puzzle.get_size())
+        elif args.cache is not None:
+            max_solutions = args.max_solutions if args.count_only or args.max_solutions is not None else 1
+            result = solve_puzzle(puzzle, args.engine, processes, max_solutions, args.time_limit, args.node_limit, stats=stats, options=options, cache=SolutionCache(path=args.cache))
+            num_solutions = len(result.solutions)
+            if args.count_only:
+                print(num_solutions)
+            elif write_solutions_to_file(args.outputfile, result.solutions, puzzle.get_size()) == 0 and result.status == 'unsatisfiable':
+                print("The puzzle has no solution")
+            if result.status not in {'solved', 'unsatisfiable'}:
+                print("Search stopped early ({}) after {} nodes".format(result.status, result.nodes))
+                if args.count_only:
+                    print("At least {} solutions".format(num_solutions))
+        elif args.count_only:
+            for _ in iter_puzzle_solutions(puzzle, args.engine, processes, args.max_solutions, stats, budget, options):
+                num_solutions += 1
+            print(num_solutions)
+        else:
+            max_solutions = 1 if args.max_solutions is None else args.max_solutions
+            solutions = iter_puzzle_solutions(puzzle, args.engine, processes, max_solutions, stats, budget, options)
+            if write_solutions_to_file(args.outputfile, solutions, puzzle.get_size()) == 0:
+                print("The puzzle has no solution")
+    except SearchLimitReached as limit:
+        print("Search stopped early ({}) after {} nodes".format(limit.reason, budget.get_num_nodes()))
+        if args.count_only:
+            print("At least {} solutions".format(num_solutions))
+    if stats is not None and (args.engine == 'cells' or args.backbone):
+        if args.stats == '-':
+            print(stats.to_json())
+        else:
+            stats_file = open(args.stats, "w")
+            stats_file.write(stats.to_json() + '\n')
+            stats_file.close()
@@ -0,0 +1,153 @@
+import itertools
+import multiprocessing
+import sys
+from typing import *
+from budget import SearchBudget, SearchLimitReached
+from csp import CSP, NogoodStore
+from main import SearchOptions, backjumping_search, backtracking_search, count_available_cores, create_csp, create_propagator, create_value_ordering, preprocess, probe_domains, probe_limit, reduce_domains
+from puzzle import Puzzle
+from stats import SolverStats
+
+
+subtrees_per_process = 8  # split finer than the process count so that idle workers can pick up the remaining subtrees
+poll_seconds = 0.1  # how often the budget is checked while waiting for the workers
+
+_worker_csp = None  # each worker process builds the puzzle's CSP once and reuses it for every subtree it solves
+_worker_search = None
+
+
+#====================================================================================
+
+
+def iter_parallel_solutions(puzzle: Puzzle, processes: Optional[int] = None, max_solutions: Optional[int] = None, stats: Optional[SolverStats] = None, budget: Optional[SearchBudget] = None, options: SearchOptions = SearchOptions()) -> Iterator[Dict[Tuple[int, int], any]]:
+    """
+    Yield the solutions of one puzzle by splitting the search tree at a shallow depth and solving the subtrees in
+    worker processes. Workers take the next unsolved subtree as soon as they are free, and the remaining work is
+    cancelled once max_solutions have been found or the caller stops iterating. If stats is given, the workers'
+    counters are added to it as their subtrees finish (search depths then count from the subtree roots).
+
+    The workers get the budget's deadline and the nodes left when the subtrees are handed out, and their nodes are
+    charged to the budget as they finish; the cancellation token is checked here while waiting for them. With
+    backjumping, each subtree is searched by backjumping from its own root. Restarts are not supported here.
+    """
+    if processes is None:
+        processes = count_available_cores()
+    if options.restarts:
+        print("Warning: restarts are not supported with several processes, searching without them", file=sys.stderr)
+    if stats is not None:
+        stats.start()
+    try:
+        csp, initial_assignments, _, _ = create_csp(puzzle)
+        csp.set_stats(stats)
+        csp.set_budget(budget)
+        csp.set_value_ordering(create_value_ordering(options.value_ordering))
+        csp.set_propagator(create_propagator(csp, options.propagation))
+        if not preprocess(csp, initial_assignments) or (options.probing and not probe_domains(csp, probe_limit)):
+            return
+        subtrees, solutions = split_search_tree(csp, processes * subtrees_per_process)
+
+        # Solutions found while splitting need no workers
+        num_solutions = 0
+        for solution in solutions:
+            yield solution
+            num_solutions += 1
+            if num_solutions == max_solutions:
+                return
+
+        # Leaving the pool's context terminates the workers still searching
+        limits = (None, None) if budget is None else (budget.get_deadline(), None if budget.get_node_limit() is None else budget.get_node_limit() - budget.get_num_nodes())
+        tasks = [(snapshot, None if max_solutions is None else max_solutions - num_solutions, stats is not None, limits) for snapshot in subtrees]
+        with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(puzzle, options)) as pool:
+            results = pool.imap_unordered(_solve_subtree, tasks, chunksize=1)
+            for _ in range(len(tasks)):
+                subtree_solutions, subtree_stats, subtree_nodes, limit_reason = _next_result(results, budget)
+                if subtree_stats is not None:
+                    stats.merge(subtree_stats)
+                if budget is not None:
+                    budget.add_nodes(subtree_nodes)
+                for solution in subtree_solutions:
+                    yield solution
+                    num_solutions += 1
+                    if num_solutions == max_solutions:
+                        return
+                if limit_reason is not None:
+                    raise SearchLimitReached(limit_reason)
+                if budget is not None:
+                    budget.check()
+    finally:
+        if stats is not None:
+            stats.stop()
+
+
+def split_search_tree(csp: CSP, min_subtrees: int, max_depth: int = 12) -> Tuple[List[Dict[any, Tuple[any, Tuple[any, ...]]]], List[Dict[Tuple[int, int], any]]]:
+    """
+    Expand the search tree breadth first until it has at least min_subtrees open nodes. Return their snapshots, in
+    the order the sequential search would visit them, and any solutions reached on the way.
+    """
+    frontier, solutions = [csp.get_snapshot()], []
+    for _ in range(max_depth):
+        if len(frontier) >= min_subtrees:
+            break
+        next_frontier = []
+        for snapshot in frontier:
+            csp.restore_snapshot(snapshot)
+            variable_to_assign = csp.select_unassigned_variable()
+            if variable_to_assign is None:
+                if csp.get_stats() is not None:
+                    csp.get_stats().record_solution()
+                solutions.append({variable.get_name(): variable.get_value() for variable in csp.get_variables()})
+                continue
+            for value in csp.order_values(variable_to_assign):
+                if csp.get_budget() is not None:
+                    csp.get_budget().charge_node()
+                checkpoint = csp.checkpoint()
+                variable_to_assign.set_value(value)
+                if reduce_domains(csp, variable_to_assign, value):
+                    next_frontier.append(csp.get_snapshot())
+                variable_to_assign.unassign()
+                csp.undo_to(checkpoint)
+        frontier = next_frontier
+        if len(frontier) == 0:
+            break
+    return frontier, solutions
+
+
+def _init_worker(puzzle: Puzzle, options: SearchOptions) -> None:
+    global _worker_csp, _worker_search
+    _worker_csp = create_csp(puzzle)[0]
+    _worker_csp.set_explaining(options.search == 'backjumping')
+    _worker_csp.set_value_ordering(create_value_ordering(options.value_ordering))
+    _worker_csp.set_propagator(create_propagator(_worker_csp, options.propagation))
+    _worker_search = options.search
+
+
+def _next_result(results: Iterator[any], budget: Optional[SearchBudget]) -> any:
+    # Wait for the next finished subtree, checking the budget in between
+    if budget is None:
+        return next(results)
+    while True:
+        try:
+            return results.next(timeout=poll_seconds)
+        except multiprocessing.TimeoutError:
+            budget.check()
+
+
+def _solve_subtree(task: Tuple[Dict[any, Tuple[any, Tuple[any, ...]]], Optional[int], bool, Tuple[Optional[float], Optional[int]]]) -> Tuple[List[Dict[Tuple[int, int], any]], Optional[Dict[str, any]], int, Optional[str]]:
+    snapshot, max_solutions, collect_stats, (deadline, node_limit) = task
+    _worker_csp.restore_snapshot(snapshot)
+    stats = SolverStats() if collect_stats else None
+    budget = SearchBudget(node_limit=node_limit, deadline=deadline)
+    _worker_csp.set_stats(stats)
+    _worker_csp.set_budget(budget)
+    solutions, limit_reason = [], None
+    # Nogoods take the subtree's root as given, so they are not carried over to other subtrees
+    if _worker_search == 'backjumping':
+        search = backjumping_search(_worker_csp, NogoodStore())
+    else:
+        search = backtracking_search(_worker_csp)
+    try:
+        for solution in itertools.islice(search, max_solutions):
+            solutions.append(solution)
+    except SearchLimitReached as limit:
+        limit_reason = limit.reason
+    return solutions, stats.to_dict() if stats is not None else None, budget.get_num_nodes(), limit_reason
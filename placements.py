@@ -0,0 +1,191 @@
+from typing import *
+from budget import SearchBudget
+from puzzle import Puzzle
+
+
+class Placement(NamedTuple):
+    """
+    One way of laying a ship on the grid: the cells it covers, their symbols and the cells around it.
+    """
+    length: int
+    cells: Tuple[Tuple[int, int], ...]
+    symbols: Tuple[str, ...]
+    halo: Tuple[Tuple[int, int], ...]
+
+
+def iter_placement_solutions(puzzle: Puzzle, budget: Optional[SearchBudget] = None) -> Iterator[Dict[Tuple[int, int], any]]:
+    """Yield the solutions of the puzzle by placing whole ships, largest first, instead of assigning cells one by one"""
+    return PlacementSearch(puzzle, budget).search()
+
+
+def create_placements(puzzle: Puzzle) -> Dict[int, List[Placement]]:
+    """Return the placements of each required ship length that agree with the tallies and hints on their own"""
+    N = puzzle.get_size()
+    required_ships = puzzle.get_required_ships()
+    placements = {}
+    for length in sorted(required_ships, reverse=True):
+        if required_ships[length] == 0:
+            continue
+        placements[length] = []
+        for i in range(N):
+            for j in range(N):
+                for di, dj in ((0, 1), (1, 0)) if length > 1 else ((0, 1),):
+                    if i + di * (length - 1) >= N or j + dj * (length - 1) >= N:
+                        continue
+                    cells = tuple((i + di * k, j + dj * k) for k in range(length))
+                    if length == 1:
+                        symbols = ('S',)
+                    elif di == 0:
+                        symbols = ('<',) + ('M',) * (length - 2) + ('>',)
+                    else:
+                        symbols = ('^',) + ('M',) * (length - 2) + ('v',)
+                    halo = tuple((a, b) for a in range(i - 1, cells[-1][0] + 2) for b in range(j - 1, cells[-1][1] + 2)
+                                 if 0 <= a < N and 0 <= b < N and (a, b) not in cells)
+                    placement = Placement(length, cells, symbols, halo)
+                    if _agrees_with_puzzle(placement, puzzle):
+                        placements[length].append(placement)
+    return placements
+
+
+def _agrees_with_puzzle(placement: Placement, puzzle: Puzzle) -> bool:
+    row_counts, col_counts = {}, {}
+    for (i, j), symbol in zip(placement.cells, placement.symbols):
+        if (i, j) in puzzle.hints and puzzle.hints[(i, j)] != symbol:
+            return False
+        row_counts[i] = row_counts.get(i, 0) + 1
+        col_counts[j] = col_counts.get(j, 0) + 1
+    for i in row_counts:
+        if row_counts[i] > puzzle.row_tallies[i]:
+            return False
+    for j in col_counts:
+        if col_counts[j] > puzzle.col_tallies[j]:
+            return False
+    for cell in placement.halo:
+        if cell in puzzle.hints and puzzle.hints[cell] != '.':
+            return False
+    return True
+
+
+class PlacementSearch:
+    """
+    Depth-first search over ship placements. Ships are placed largest first, ships of the same length in increasing
+    placement order so that each grid is produced once, and no ship may touch another. A placement blocks its cells
+    and the cells around it, and a branch fails as soon as a row or column has fewer free cells than ship cells still
+    owed to it, or a hinted ship cell can no longer be covered. Each placement tried is one node of the budget.
+    """
+
+    def __init__(self, puzzle: Puzzle, budget: Optional[SearchBudget] = None):
+        self._N = puzzle.get_size()
+        self._puzzle = puzzle
+        self._budget = budget
+        self._placements = create_placements(puzzle)
+        required_ships = puzzle.get_required_ships()
+        self._ships = [length for length in sorted(required_ships, reverse=True) for _ in range(required_ships[length])]
+
+        self._row_remaining = list(puzzle.row_tallies)
+        self._col_remaining = list(puzzle.col_tallies)
+        self._row_free = [self._N] * self._N
+        self._col_free = [self._N] * self._N
+        self._blocked = [[0] * self._N for _ in range(self._N)]  # how many placed ships block each cell
+        self._covered = {}  # cell -> symbol of the ship covering it
+
+        # Placements that could cover each hinted ship cell
+        self._uncovered_hints = {cell for cell in puzzle.hints if puzzle.hints[cell] != '.'}
+        self._hint_placements = {cell: [] for cell in self._uncovered_hints}
+        for length in self._placements:
+            for placement in self._placements[length]:
+                for cell in placement.cells:
+                    if cell in self._hint_placements:
+                        self._hint_placements[cell].append(placement)
+
+    def search(self) -> Iterator[Dict[Tuple[int, int], any]]:
+        num_ship_cells = sum(length for length in self._ships)
+        if sum(self._puzzle.row_tallies) != num_ship_cells or sum(self._puzzle.col_tallies) != num_ship_cells:
+            return
+        for cell, symbol in self._puzzle.hints.items():
+            if symbol == '.':
+                self._block(cell)  # water hints are free for no ship
+        yield from self._search(0, 0)
+
+    def _search(self, ship_index: int, first_placement_index: int) -> Iterator[Dict[Tuple[int, int], any]]:
+        if ship_index == len(self._ships):
+            if len(self._uncovered_hints) == 0:
+                yield {(i, j): self._covered.get((i, j), '.') for i in range(self._N) for j in range(self._N)}
+            return
+
+        length = self._ships[ship_index]
+        placements = self._placements.get(length, [])
+        for placement_index in range(first_placement_index, len(placements)):
+            placement = placements[placement_index]
+            if not self._can_place(placement):
+                continue
+            if self._budget is not None:
+                self._budget.charge_node()
+            self._place(placement)
+            try:
+                if self._is_consistent(placement, ship_index + 1):
+                    same_length = ship_index + 1 < len(self._ships) and self._ships[ship_index + 1] == length
+                    yield from self._search(ship_index + 1, placement_index + 1 if same_length else 0)
+            finally:
+                self._unplace(placement)
+
+    def _can_place(self, placement: Placement) -> bool:
+        row_counts, col_counts = {}, {}
+        for i, j in placement.cells:
+            if self._blocked[i][j] > 0:
+                return False
+            row_counts[i] = row_counts.get(i, 0) + 1
+            col_counts[j] = col_counts.get(j, 0) + 1
+        for i in row_counts:
+            if row_counts[i] > self._row_remaining[i]:
+                return False
+        for j in col_counts:
+            if col_counts[j] > self._col_remaining[j]:
+                return False
+        return True
+
+    def _place(self, placement: Placement) -> None:
+        for cell, symbol in zip(placement.cells, placement.symbols):
+            self._covered[cell] = symbol
+            self._row_remaining[cell[0]] -= 1
+            self._col_remaining[cell[1]] -= 1
+            self._uncovered_hints.discard(cell)
+        for cell in placement.cells + placement.halo:
+            self._block(cell)
+
+    def _unplace(self, placement: Placement) -> None:
+        for cell in placement.cells + placement.halo:
+            self._unblock(cell)
+        for cell in placement.cells:
+            del self._covered[cell]
+            self._row_remaining[cell[0]] += 1
+            self._col_remaining[cell[1]] += 1
+            if cell in self._hint_placements:
+                self._uncovered_hints.add(cell)
+
+    def _block(self, cell: Tuple[int, int]) -> None:
+        i, j = cell
+        self._blocked[i][j] += 1
+        if self._blocked[i][j] == 1:
+            self._row_free[i] -= 1
+            self._col_free[j] -= 1
+
+    def _unblock(self, cell: Tuple[int, int]) -> None:
+        i, j = cell
+        self._blocked[i][j] -= 1
+        if self._blocked[i][j] == 0:
+            self._row_free[i] += 1
+            self._col_free[j] += 1
+
+    def _is_consistent(self, placement: Placement, next_ship_index: int) -> bool:
+        # Every row and column touched must still have room for the ship cells it is owed
+        for i, j in placement.cells + placement.halo:
+            if self._row_remaining[i] > self._row_free[i] or self._col_remaining[j] > self._col_free[j]:
+                return False
+
+        # Every hinted ship cell must still be coverable by one of the ships left to place
+        remaining_lengths = set(self._ships[next_ship_index:])
+        for cell in self._uncovered_hints:
+            if not any(other.length in remaining_lengths and self._can_place(other) for other in self._hint_placements[cell]):
+                return False
+        return True
@@ -0,0 +1,173 @@
+import itertools
+import json
+import sys
+from typing import *
+
+
+ship_lengths = {'submarines': 1, 'destroyers': 2, 'cruisers': 3, 'battleships': 4}
+
+
+class PuzzleError(ValueError):
+    """
+    A puzzle in a file of several that could not be parsed, read in its place so that the others are still read.
+    """
+
+
+class Puzzle(NamedTuple):
+    """
+    A puzzle as given: row and column tallies, the number of ships of each type and the hinted cells.
+    """
+    row_tallies: List[int]
+    col_tallies: List[int]
+    ship_constraints: Dict[str, int]
+    hints: Dict[Tuple[int, int], str]
+
+    def get_size(self) -> int:
+        return len(self.row_tallies)
+
+    def get_required_ships(self) -> Dict[int, int]:
+        """Return the number of ships required of each length"""
+        return {ship_lengths[ship_type]: self.ship_constraints[ship_type] for ship_type in self.ship_constraints}
+
+
+def read_puzzle_from_file(filename: str) -> Puzzle:
+    f = open(filename)
+    lines = f.readlines()
+    f.close()
+    return parse_puzzle(lines)
+
+
+def read_puzzles_from_file(filename: str) -> List[Puzzle]:
+    """Read a file holding one or more puzzles separated by blank lines"""
+    f = open(filename)
+    try:
+        return list(iter_puzzles(f))
+    finally:
+        f.close()
+
+
+def iter_puzzles(lines: Iterable[str]) -> Iterator[Puzzle]:
+    """Yield the puzzles of the text format, separated by blank lines, as soon as each one has been read"""
+    return (parse_puzzle(puzzle_lines) for _, puzzle_lines in iter_puzzle_lines(lines))
+
+
+def iter_puzzle_lines(lines: Iterable[str]) -> Iterator[Tuple[int, List[str]]]:
+    """Yield the number of the first line (from 1) and the lines of each puzzle of the text format"""
+    puzzle_lines, first_line_number = [], 0
+    for line_number, line in enumerate(itertools.chain(lines, ['']), 1):
+        if line.strip() == '':
+            if len(puzzle_lines) > 0:
+                yield first_line_number, puzzle_lines
+            puzzle_lines = []
+        else:
+            if len(puzzle_lines) == 0:
+                first_line_number = line_number
+            puzzle_lines.append(line)
+
+
+def iter_puzzle_records(lines: Iterable[str]) -> Iterator[Tuple[Optional[any], Union[Puzzle, PuzzleError]]]:
+    """
+    Yield the (id, puzzle) of each line of the line-delimited JSON format as soon as it has been read. Each line is
+    an object as read by parse_puzzle_json, with an optional id; blank lines are skipped. A line that cannot be
+    parsed is yielded as a PuzzleError naming the line, with its id if it has one.
+    """
+    for line_number, line in enumerate(lines, 1):
+        if line.strip() != '':
+            record_id = None
+            try:
+                record = json.loads(line)
+                record_id = record.get('id')
+                puzzle = parse_puzzle_json(record)
+            except (ValueError, KeyError, IndexError, TypeError, AttributeError) as error:
+                puzzle = PuzzleError("line {}: {}: {}".format(line_number, type(error).__name__, error))
+            yield record_id, puzzle
+
+
+def iter_puzzles_from_file(filename: str) -> Iterator[Tuple[Optional[any], Union[Puzzle, PuzzleError]]]:
+    """
+    Yield the (id, puzzle) of each puzzle in a file ('-' for stdin) lazily, in line-delimited JSON if the file
+    starts with '{' and in the text format otherwise, where puzzles have no id. Puzzles that cannot be parsed are
+    yielded as PuzzleErrors, see iter_puzzle_records.
+    """
+    f = sys.stdin if filename == '-' else open(filename)
+    try:
+        lines = iter(f)
+        first_lines = []
+        for line in lines:
+            first_lines.append(line)
+            if line.strip() != '':
+                break
+        lines = itertools.chain(first_lines, lines)
+        if len(first_lines) > 0 and first_lines[-1].lstrip().startswith('{'):
+            yield from iter_puzzle_records(lines)
+        else:
+            for line_number, puzzle_lines in iter_puzzle_lines(lines):
+                try:
+                    puzzle = parse_puzzle(puzzle_lines)
+                except (ValueError, KeyError, IndexError, TypeError) as error:
+                    puzzle = PuzzleError("line {}: {}: {}".format(line_number, type(error).__name__, error))
+                yield None, puzzle
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def parse_puzzle(lines: List[str]) -> Puzzle:
+    """Parse the text format: row tallies, column tallies, ship counts, then one line per row with '0' for unknown cells"""
+    row_tallies, col_tallies, ship_tallies = parse_tallies(lines[0]), parse_tallies(lines[1]), parse_tallies(lines[2])
+    ship_constraints = {'submarines': ship_tallies[0], 'destroyers': ship_tallies[1], 'cruisers': ship_tallies[2], 'battleships': ship_tallies[3]}
+    hints = {}
+    for i in range(len(row_tallies)):
+        for j in range(len(col_tallies)):
+            if lines[3 + i][j] != '0':
+                hints[(i, j)] = lines[3 + i][j]
+    return Puzzle(row_tallies, col_tallies, ship_constraints, hints)
+
+
+def parse_tallies(line: str) -> List[int]:
+    """Parse a line of tallies, either one digit per entry or entries separated by spaces/commas (needed for 10+)"""
+    line = line.strip()
+    if any(separator in line for separator in ' ,\t'):
+        return [int(tally) for tally in line.replace(',', ' ').split()]
+    return [int(tally) for tally in line]
+
+
+def format_puzzle(puzzle: Puzzle) -> List[str]:
+    """Return the lines of the text format, separating tallies with spaces when some tally has two digits"""
+    tallies = [puzzle.row_tallies, puzzle.col_tallies, [puzzle.ship_constraints[ship_type] for ship_type in ship_lengths]]
+    separator = ' ' if any(tally >= 10 for line in tallies for tally in line) else ''
+    lines = [separator.join(str(tally) for tally in line) for line in tallies]
+    for i in range(puzzle.get_size()):
+        lines.append(''.join(puzzle.hints.get((i, j), '0') for j in range(len(puzzle.col_tallies))))
+    return lines
+
+
+def format_puzzle_json(puzzle: Puzzle) -> Dict[str, any]:
+    """Return the JSON object of the puzzle as read by parse_puzzle_json"""
+    return {
+        'row_tallies': list(puzzle.row_tallies),
+        'col_tallies': list(puzzle.col_tallies),
+        'ships': {ship_type: puzzle.ship_constraints.get(ship_type, 0) for ship_type in ship_lengths},
+        'rows': format_puzzle(puzzle)[3:],
+    }
+
+
+def parse_puzzle_json(data: Dict[str, any]) -> Puzzle:
+    """
+    Build a puzzle from a JSON object with row_tallies, col_tallies, ships (counts by ship type, or four counts from
+    submarines to battleships) and optionally rows, the grid lines of the text format
+    """
+    ships = data['ships']
+    if isinstance(ships, dict):
+        ship_constraints = {ship_type: int(ships.get(ship_type, 0)) for ship_type in ship_lengths}
+    elif len(ships) == len(ship_lengths):
+        ship_constraints = {ship_type: int(count) for ship_type, count in zip(ship_lengths, ships)}
+    else:
+        raise ValueError("expected {} ship counts, got {}".format(len(ship_lengths), len(ships)))
+    row_tallies, col_tallies = [int(tally) for tally in data['row_tallies']], [int(tally) for tally in data['col_tallies']]
+    hints = {}
+    for i, line in enumerate(data.get('rows', [])):
+        for j in range(len(col_tallies)):
+            if line[j] != '0':
+                hints[(i, j)] = line[j]
+    return Puzzle(row_tallies, col_tallies, ship_constraints, hints)
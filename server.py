@@ -0,0 +1,117 @@
+import argparse
+import json
+import multiprocessing
+import sys
+import threading
+import time
+from typing import *
+from batch import solve_task
+from main import count_available_cores, engines, shared_cache_help
+from puzzle import Puzzle, parse_puzzle, parse_puzzle_json
+
+
+class SolverServer:
+    """
+    Long-running solver speaking line-delimited JSON. Each request line holds an object with an optional id, the
+    puzzle (in the text format as one string, or as a JSON object, see puzzle.parse_puzzle_json), and optionally the
+    engine and a deadline in seconds from when the request was read. Requests are solved concurrently on a worker
+    pool and each response line is written as soon as its puzzle is done, so responses may come out of order.
+    """
+
+    def __init__(self, output: TextIO, processes: Optional[int] = None, engine: str = 'cells', cache_path: Optional[str] = None):
+        if processes is None:
+            processes = count_available_cores()
+        self._output = output
+        self._engine = engine
+        self._cache_path = cache_path  # SQLite solution cache shared by the workers, if any
+        self._pool = multiprocessing.Pool(processes)
+        self._output_lock = threading.Lock()  # responses are written from the pool's result thread
+        self._num_requests = 0
+
+    def handle_line(self, line: str) -> None:
+        """Parse one request line and queue it, answering malformed requests straight away"""
+        if line.strip() == '':
+            return
+        received = time.time()
+        self._num_requests += 1
+        request_id = self._num_requests
+        try:
+            request = json.loads(line)
+            request_id = request.get('id', request_id)
+            puzzle = read_request_puzzle(request['puzzle'])
+            engine = request.get('engine', self._engine)
+            if engine not in engines:
+                raise ValueError("unknown engine {}".format(engine))
+            deadline = request.get('deadline')
+            deadline = None if deadline is None else received + float(deadline)
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError) as error:
+            self._write({'id': request_id, 'status': 'error', 'error': '{}: {}'.format(type(error).__name__, error)})
+            return
+        task = (request_id, puzzle, engine, deadline, received, self._cache_path)
+        self._pool.apply_async(solve_request, (task,), callback=self._write)
+
+    def close(self) -> None:
+        """Wait for the queued requests to be answered and stop the workers"""
+        self._pool.close()
+        self._pool.join()
+
+    def _write(self, response: Dict[str, any]) -> None:
+        with self._output_lock:
+            self._output.write(json.dumps(response) + '\n')
+            self._output.flush()
+
+
+def read_request_puzzle(puzzle: Union[str, Dict[str, any]]) -> Puzzle:
+    if isinstance(puzzle, str):
+        return parse_puzzle(puzzle.strip().splitlines())
+    return parse_puzzle_json(puzzle)
+
+
+def solve_request(task: Tuple[any, Puzzle, str, Optional[float], float, Optional[str]]) -> Dict[str, any]:
+    """Solve one request in a worker, reporting how long it queued, how long it took to solve and its total latency"""
+    request_id, puzzle, engine, deadline, received, cache_path = task
+    started = time.time()
+    if deadline is not None and started >= deadline:
+        result = {'status': 'timeout', 'seconds': 0.0, 'nodes': 0, 'solution': None}  # expired while queued
+    else:
+        result = solve_task((request_id, puzzle, engine, None if deadline is None else deadline - started, cache_path))
+    response = {'id': request_id, 'status': result['status'], 'solution': result['solution'], 'nodes': result['nodes']}
+    if 'error' in result:
+        response['error'] = result['error']
+    response['queue_seconds'] = started - received
+    response['solve_seconds'] = result['seconds']
+    response['total_seconds'] = time.time() - received
+    return response
+
+
+#====================================================================================
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Solve puzzles sent as JSON lines on stdin, answering with JSON lines on stdout.")
+    parser.add_argument(
+        "--engine",
+        choices=engines,
+        default='cells',
+        help="Default engine for requests that do not name one."
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: one per available core)."
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default=None,
+        help=shared_cache_help
+    )
+    args = parser.parse_args()
+
+    server = SolverServer(sys.stdout, args.processes, args.engine, args.cache)
+    try:
+        for line in sys.stdin:
+            server.handle_line(line)
+    finally:
+        server.close()
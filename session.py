@@ -0,0 +1,142 @@
+import itertools
+from typing import *
+from budget import SearchBudget
+from main import backtracking_search, create_csp, find_backbone, reduce_domains
+from puzzle import Puzzle
+
+
+class HintEntry(NamedTuple):
+    """
+    A hint added to a session, with the trail checkpoint taken before it, whether the session was consistent then,
+    and the cell's value before it (None unless the tallies had already decided the cell).
+    """
+    cell: Tuple[int, int]
+    symbol: str
+    checkpoint: int
+    was_consistent: bool
+    previous_value: any = None
+
+
+class SolverSession:
+    """
+    Stateful solving of one puzzle while its hints change. The tallies and fleet are propagated once; each hint is
+    then an assignment propagated on top of the current state, and removing the latest hints undoes them on the
+    trail. Removing an earlier hint undoes back to it and replays the ones added after it. Queries search from the
+    current state and leave it as they found it.
+    """
+
+    def __init__(self, puzzle: Puzzle):
+        self._puzzle = puzzle
+        # The session keeps its CSP for its whole life, so it does not take the shared board template
+        self._csp, initial_assignments, _, self._N = create_csp(puzzle._replace(hints={}), use_template=False)
+        self._variables = {variable.get_name(): variable for variable in self._csp.get_variables()}
+        self._consistent = all(reduce_domains(self._csp, variable, value) for variable, value in initial_assignments.items()) and self._csp.propagate()
+        self._hints = []  # HintEntry of each hint, oldest first
+        self._marks = []  # number of hints at each push
+        for cell, symbol in puzzle.hints.items():
+            self.add_hint(cell, symbol)
+
+    def get_hints(self) -> Dict[Tuple[int, int], str]:
+        return {entry.cell: entry.symbol for entry in self._hints}
+
+    def add_hint(self, cell: Tuple[int, int], symbol: str) -> bool:
+        """Add a hint and propagate it, returning whether the hints are still consistent as far as propagation can tell"""
+        variable = self._variables[cell]
+        if any(entry.cell == cell for entry in self._hints):
+            raise ValueError("cell {} already has a hint".format(cell))
+        if not variable.get_encoding().get_bit(symbol):
+            raise ValueError("{} is not a cell symbol".format(symbol))
+        entry = HintEntry(cell, symbol, self._csp.checkpoint(), self._consistent, variable.get_value())
+        in_domain = variable.value_in_curr_domain(symbol)
+        variable.set_value(symbol)
+        self._hints.append(entry)
+        if self._consistent:
+            self._consistent = in_domain and reduce_domains(self._csp, variable, symbol)
+        return self._consistent
+
+    def remove_hint(self, cell: Tuple[int, int]) -> bool:
+        """Remove a hint, returning whether the remaining hints are consistent as far as propagation can tell"""
+        index = next((k for k, entry in enumerate(self._hints) if entry.cell == cell), None)
+        if index is None:
+            raise ValueError("cell {} has no hint".format(cell))
+        later_hints = self._hints[index + 1:]
+        self._undo_hints(index)
+        for entry in later_hints:
+            self.add_hint(entry.cell, entry.symbol)
+        self._marks = [mark - 1 if mark > index else mark for mark in self._marks]
+        return self._consistent
+
+    def push(self) -> int:
+        """Remember the current hints so that pop can go back to them, returning the number of pushes open"""
+        self._marks.append(len(self._hints))
+        return len(self._marks)
+
+    def pop(self) -> None:
+        """Undo every hint added since the matching push"""
+        self._undo_hints(self._marks.pop())
+
+    def is_consistent(self) -> bool:
+        """Return False if propagating the hints alone already shows that there is no solution"""
+        return self._consistent
+
+    def is_solvable(self, budget: Optional[SearchBudget] = None) -> bool:
+        return self.get_solution(budget) is not None
+
+    def get_solution(self, budget: Optional[SearchBudget] = None) -> Optional[Dict[Tuple[int, int], any]]:
+        solutions = self._iter_solutions(budget)
+        try:
+            return next(solutions, None)
+        finally:
+            solutions.close()
+
+    def count_solutions(self, max_solutions: Optional[int] = None, budget: Optional[SearchBudget] = None) -> int:
+        """Count the solutions left with the current hints, stopping early once max_solutions have been found"""
+        solutions = self._iter_solutions(budget)
+        try:
+            return sum(1 for _ in itertools.islice(solutions, max_solutions))
+        finally:
+            solutions.close()
+
+    def is_unique(self, budget: Optional[SearchBudget] = None) -> bool:
+        return self.count_solutions(2, budget) == 1
+
+    def get_backbone(self, budget: Optional[SearchBudget] = None) -> Optional[Dict[Tuple[int, int], str]]:
+        """Return the cells that have the same symbol in every solution left, hints included, or None if there is none"""
+        if not self._consistent:
+            return None
+        self._csp.set_budget(budget)
+        try:
+            return find_backbone(self._csp)
+        finally:
+            self._csp.set_budget(None)
+
+    def get_forced_cells(self) -> Dict[Tuple[int, int], str]:
+        """Return the cells without a hint whose symbol propagation has already decided"""
+        if not self._consistent:
+            return {}
+        return {cell: variable.get_curr_domain()[0] for cell, variable in self._variables.items()
+                if not variable.is_assigned() and variable.get_curr_domain_size() == 1}
+
+    def get_candidates(self, cell: Tuple[int, int]) -> Tuple[str, ...]:
+        """Return the symbols the cell can still take as far as propagation can tell"""
+        return self._variables[cell].get_curr_domain()
+
+    def _iter_solutions(self, budget: Optional[SearchBudget]) -> Generator[Dict[Tuple[int, int], any], None, None]:
+        if not self._consistent:
+            return
+        self._csp.set_budget(budget)
+        try:
+            yield from backtracking_search(self._csp)
+        finally:
+            self._csp.set_budget(None)
+
+    def _undo_hints(self, num_hints: int) -> None:
+        # Undo the hints after the first num_hints, latest first
+        while len(self._hints) > num_hints:
+            entry = self._hints.pop()
+            if entry.previous_value is None:
+                self._variables[entry.cell].unassign()
+            else:
+                self._variables[entry.cell].set_value(entry.previous_value)
+            self._csp.undo_to(entry.checkpoint)
+            self._consistent = entry.was_consistent
@@ -0,0 +1,103 @@
+import json
+import time
+from typing import *
+
+
+class SolverStats:
+    """
+    Counters filled in by the cell-level search when a CSP has a stats object attached (see CSP.set_stats). Without
+    one, the search and propagation loops skip all of this. A node is one value tried for a variable, a failure is a
+    node whose propagation wiped out a domain, and a backtrack is a variable whose values were all tried without
+    reaching a solution. Values pruned by the constraints of the variable just assigned count as forward checking,
+    those pruned by the constraints queued after them (or by propagating every constraint) as AC3.
+    """
+
+    def __init__(self, callback: Optional[Callable[[Dict[str, any]], None]] = None, callback_interval: int = 10000):
+        self._callback = callback  # called with to_dict() every callback_interval nodes and when the search stops
+        self._callback_interval = callback_interval
+        self._nodes = 0
+        self._failures = 0
+        self._backtracks = 0
+        self._solutions = 0
+        self._max_depth = 0
+        self._pruned_by_forward_checking = 0
+        self._pruned_by_ac3 = 0
+        self._propagators = {}  # constraint class name -> [calls, failures, values pruned, seconds]
+        self._seconds = 0.0
+        self._start_time = None
+
+    def start(self) -> None:
+        self._start_time = time.perf_counter()
+
+    def stop(self) -> None:
+        if self._start_time is not None:
+            self._seconds += time.perf_counter() - self._start_time
+            self._start_time = None
+        if self._callback is not None:
+            self._callback(self.to_dict())
+
+    def get_num_solutions(self) -> int:
+        return self._solutions
+
+    def record_node(self, depth: int) -> None:
+        self._nodes += 1
+        if depth > self._max_depth:
+            self._max_depth = depth
+        if self._callback is not None and self._nodes % self._callback_interval == 0:
+            self._callback(self.to_dict())
+
+    def record_failure(self) -> None:
+        self._failures += 1
+
+    def record_backtrack(self) -> None:
+        self._backtracks += 1
+
+    def record_solution(self) -> None:
+        self._solutions += 1
+
+    def record_propagation(self, constraint_type: str, seconds: float, num_pruned: int, forward_checking: bool, failed: bool) -> None:
+        if forward_checking:
+            self._pruned_by_forward_checking += num_pruned
+        else:
+            self._pruned_by_ac3 += num_pruned
+        propagator = self._propagators.setdefault(constraint_type, [0, 0, 0, 0.0])
+        propagator[0] += 1
+        propagator[1] += failed
+        propagator[2] += num_pruned
+        propagator[3] += seconds
+
+    def merge(self, other: Dict[str, any]) -> None:
+        """Add the counters of another search, given as to_dict(), e.g. from a worker process"""
+        self._nodes += other['nodes']
+        self._failures += other['failures']
+        self._backtracks += other['backtracks']
+        self._solutions += other['solutions']
+        self._max_depth = max(self._max_depth, other['max_depth'])
+        self._pruned_by_forward_checking += other['pruned_by_forward_checking']
+        self._pruned_by_ac3 += other['pruned_by_ac3']
+        for constraint_type, counters in other['propagators'].items():
+            propagator = self._propagators.setdefault(constraint_type, [0, 0, 0, 0.0])
+            propagator[0] += counters['calls']
+            propagator[1] += counters['failures']
+            propagator[2] += counters['pruned']
+            propagator[3] += counters['seconds']
+
+    def to_dict(self) -> Dict[str, any]:
+        seconds = self._seconds
+        if self._start_time is not None:
+            seconds += time.perf_counter() - self._start_time
+        return {
+            'nodes': self._nodes,
+            'failures': self._failures,
+            'backtracks': self._backtracks,
+            'solutions': self._solutions,
+            'max_depth': self._max_depth,
+            'pruned_by_forward_checking': self._pruned_by_forward_checking,
+            'pruned_by_ac3': self._pruned_by_ac3,
+            'propagators': {constraint_type: {'calls': calls, 'failures': failures, 'pruned': pruned, 'seconds': propagator_seconds}
+                            for constraint_type, (calls, failures, pruned, propagator_seconds) in sorted(self._propagators.items())},
+            'seconds': seconds,
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
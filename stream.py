@@ -0,0 +1,146 @@
+import argparse
+import collections
+import json
+import multiprocessing
+import sys
+from typing import *
+from batch import solve_task
+from main import count_available_cores, engine_help, engines, shared_cache_help, timeout_help
+from puzzle import Puzzle, PuzzleError, format_puzzle, format_puzzle_json, iter_puzzles_from_file
+
+
+class RecordWriter:
+    """
+    Writes one JSON object per line to a stream, flushing after every flush_every records rather than after each one
+    so that large outputs are not dominated by small writes.
+    """
+
+    def __init__(self, output: TextIO, flush_every: int = 100):
+        self._output = output
+        self._flush_every = flush_every
+        self._num_pending = 0
+
+    def write(self, record: Dict[str, any]) -> None:
+        self._output.write(json.dumps(record) + '\n')
+        self._num_pending += 1
+        if self._num_pending >= self._flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        self._output.flush()
+        self._num_pending = 0
+
+
+#====================================================================================
+
+
+def solve_stream(records: Iterable[Tuple[Optional[any], Union[Puzzle, PuzzleError]]], engine: str = 'cells', processes: int = 1, timeout: Optional[float] = None, cache_path: Optional[str] = None) -> Iterator[Dict[str, any]]:
+    """
+    Solve (id, puzzle) records as they are read and yield their results (see batch.solve_task) in input order,
+    named by id or by position from 1; records that could not be read get an error result in their place. With
+    several processes, at most a few puzzles per process are read ahead of the results, so that inputs of any length
+    are solved in bounded memory.
+    """
+    tasks = ((record_id if record_id is not None else k + 1, puzzle, engine, timeout, cache_path) for k, (record_id, puzzle) in enumerate(records))
+    if processes == 1:
+        yield from map(solve_task, tasks)
+        return
+    with multiprocessing.Pool(processes) as pool:
+        pending = collections.deque()
+        for task in tasks:
+            pending.append(pool.apply_async(solve_task, (task,)))
+            if len(pending) >= 4 * processes:
+                yield pending.popleft().get()
+        while len(pending) > 0:
+            yield pending.popleft().get()
+
+
+def convert_stream(records: Iterable[Tuple[Optional[any], Union[Puzzle, PuzzleError]]], output: TextIO, puzzle_format: str) -> int:
+    """
+    Write the puzzles as line-delimited JSON or in the text format separated by blank lines, returning how many were
+    written. Records that could not be read are skipped with a warning.
+    """
+    writer = RecordWriter(output)
+    num_puzzles = 0
+    for record_id, puzzle in records:
+        if isinstance(puzzle, PuzzleError):
+            print("Warning: skipping a puzzle that could not be read ({})".format(puzzle), file=sys.stderr)
+            continue
+        if puzzle_format == 'jsonl':
+            record = {'id': record_id} if record_id is not None else {}
+            record.update(format_puzzle_json(puzzle))
+            writer.write(record)
+        else:
+            if num_puzzles > 0:
+                output.write('\n')
+            output.write(''.join(line + '\n' for line in format_puzzle(puzzle)))
+        num_puzzles += 1
+    writer.flush()
+    return num_puzzles
+
+
+#====================================================================================
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Solve a stream of puzzles, in line-delimited JSON or the text format, into line-delimited JSON results.")
+    parser.add_argument(
+        "--inputfile",
+        type=str,
+        default='-',
+        help="Puzzles as JSON lines or as text separated by blank lines (default: stdin)."
+    )
+    parser.add_argument(
+        "--outputfile",
+        type=str,
+        default='-',
+        help="File to write one JSON result per puzzle into, in input order (default: stdout)."
+    )
+    parser.add_argument(
+        "--convert",
+        choices=('jsonl', 'text'),
+        default=None,
+        help="Instead of solving, rewrite the puzzles in this format."
+    )
+    parser.add_argument(
+        "--engine",
+        choices=engines,
+        default='cells',
+        help=engine_help
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Number of worker processes (0 for one per available core)."
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help=timeout_help
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default=None,
+        help=shared_cache_help
+    )
+    args = parser.parse_args()
+
+    records = iter_puzzles_from_file(args.inputfile)
+    output = sys.stdout if args.outputfile == '-' else open(args.outputfile, "w")
+    try:
+        if args.convert is not None:
+            convert_stream(records, output, args.convert)
+        else:
+            processes = args.processes
+            if processes == 0:
+                processes = count_available_cores()
+            writer = RecordWriter(output)
+            for result in solve_stream(records, args.engine, processes, args.timeout, args.cache):
+                writer.write(result)
+            writer.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
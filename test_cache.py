@@ -0,0 +1,27 @@
+import pytest
+from cache import SolutionCache, symmetries
+from generator import generate_puzzle
+from main import iter_puzzle_solutions
+
+
+def get_solution_set(puzzle):
+    return {tuple(sorted(solution.items())) for solution in iter_puzzle_solutions(puzzle)}
+
+
+@pytest.mark.parametrize("symmetry", symmetries)
+def test_symbols_map_back(symmetry):
+    for symbol in ('S', '<', '>', '^', 'v', 'M', '.'):
+        assert symmetry.unmap_symbol(symmetry.map_symbol(symbol)) == symbol
+
+
+@pytest.mark.parametrize("N,difficulty,seed", [(6, 'hard', 1), (7, 'hard', 3)])
+def test_symmetries_share_one_entry(N, difficulty, seed):
+    puzzle, _ = generate_puzzle(N, difficulty, seed)
+    cache = SolutionCache()
+    cache.put(puzzle, list(iter_puzzle_solutions(puzzle)), True)
+    for symmetry in symmetries:
+        mirrored_puzzle = symmetry.apply(puzzle)
+        solutions = cache.get(mirrored_puzzle, None)
+        assert solutions is not None
+        assert {tuple(sorted(solution.items())) for solution in solutions} == get_solution_set(mirrored_puzzle)
+    assert len(cache) == 1
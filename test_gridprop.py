@@ -0,0 +1,17 @@
+import pytest
+from generator import generate_puzzle
+from main import SearchOptions, iter_puzzle_solutions
+
+pytest.importorskip("numpy")
+
+
+def get_solution_set(puzzle, propagation):
+    return {tuple(sorted(solution.items())) for solution in iter_puzzle_solutions(puzzle, options=SearchOptions(propagation=propagation))}
+
+
+@pytest.mark.parametrize("N,difficulty,seed", [(5, 'hard', seed) for seed in range(4)] + [(6, 'hard', seed) for seed in range(4)] + [(7, 'hard', 3), (7, 'hard', 19), (7, 'medium', 19)])
+def test_numpy_finds_the_same_solutions_as_objects(N, difficulty, seed):
+    puzzle, grid = generate_puzzle(N, difficulty, seed)
+    solutions = get_solution_set(puzzle, 'objects')
+    assert tuple(sorted(grid.items())) in solutions
+    assert get_solution_set(puzzle, 'numpy') == solutions
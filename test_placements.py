@@ -0,0 +1,15 @@
+import pytest
+from generator import generate_puzzle
+from main import iter_puzzle_solutions
+
+
+def get_solution_set(puzzle, engine):
+    return {tuple(sorted(solution.items())) for solution in iter_puzzle_solutions(puzzle, engine)}
+
+
+@pytest.mark.parametrize("N,difficulty,seed", [(5, 'hard', seed) for seed in range(4)] + [(6, 'hard', seed) for seed in range(4)] + [(7, 'hard', 3), (7, 'medium', 19)])
+def test_placements_find_the_same_solutions_as_cells(N, difficulty, seed):
+    puzzle, grid = generate_puzzle(N, difficulty, seed)
+    solutions = get_solution_set(puzzle, 'cells')
+    assert tuple(sorted(grid.items())) in solutions
+    assert get_solution_set(puzzle, 'placements') == solutions